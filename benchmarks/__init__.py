@@ -0,0 +1,3 @@
+"""
+Benchmarks for User Manager Application.
+"""
@@ -0,0 +1,111 @@
+"""
+Benchmarks for User Manager Application.
+
+Run with ``make benchmark``, or directly with::
+
+    BENCHMARK_ROLES=100000 py.test --ds benchmarks.settings benchmarks/bench_user_manager.py
+
+Results are written to ``BENCHMARK_OUTPUT`` (``benchmark-results.json`` by
+default) so runs of different versions can be compared.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import json
+
+from django.contrib.auth.models import User
+from django.urls import reverse
+
+from user_manager.roles import ManagerRole
+
+
+def _username(user_id):
+    return User.objects.values_list('username', flat=True).get(id=user_id)
+
+
+def test_managers_list(admin_client, org, recorder):  # pylint: disable=unused-argument
+    url = reverse('user_manager_api:v1:managers-list')
+    recorder.measure('GET managers', lambda: admin_client.get(url, {'page': 2}))
+    recorder.measure('GET managers cursor', lambda: admin_client.get(url, {'pagination': 'cursor', 'count': 'false'}))
+
+
+def test_user_managers_list(admin_client, org, recorder):
+    url = reverse('user_manager_api:v1:user-managers-list', kwargs={'username': _username(org.report_id)})
+    recorder.measure('GET managers/{user_id}', lambda: admin_client.get(url))
+    recorder.measure('POST managers/{user_id}', lambda: admin_client.post(url, {'email': 'new@example.com'}), rollback=True)
+    recorder.measure('DELETE managers/{user_id}', lambda: admin_client.delete(url), rollback=True)
+
+
+def test_manager_reports_list(admin_client, org, recorder):
+    top_url = reverse('user_manager_api:v1:manager-reports-list', kwargs={'username': _username(org.top_manager_id)})
+    url = reverse('user_manager_api:v1:manager-reports-list', kwargs={'username': _username(org.median_manager_id)})
+    recorder.measure('GET reports/{user_id} top manager', lambda: admin_client.get(top_url))
+    recorder.measure('GET reports/{user_id} median manager', lambda: admin_client.get(url))
+    recorder.measure(
+        'GET reports/{user_id}?depth=all top manager',
+        lambda: b''.join(admin_client.get(top_url, {'depth': 'all'}).streaming_content),
+        iterations=5,
+    )
+    emails = list(User.objects.filter(id__in=org.user_ids[-500:]).values_list('email', flat=True))
+    recorder.measure(
+        'POST reports/{user_id} email',
+        lambda: admin_client.post(url, {'email': emails[0]}),
+        rollback=True,
+    )
+    recorder.measure(
+        'POST reports/{user_id} 500 emails',
+        lambda: admin_client.post(url, json.dumps({'emails': emails}), content_type='application/json'),
+        iterations=5,
+        rollback=True,
+    )
+    recorder.measure('DELETE reports/{user_id} top manager', lambda: admin_client.delete(top_url), rollback=True)
+
+
+def test_user_managers_lookup(admin_client, org, recorder):
+    url = reverse('user_manager_api:v1:user-managers-lookup')
+    users = list(User.objects.filter(id__in=org.user_ids[-1000:]).values_list('id', 'username', 'email'))
+    # A third of the users are given by each kind of identifier.
+    identifiers = [user[index % 3] for index, user in enumerate(users)]
+    recorder.measure(
+        'POST managers/lookup 1 user',
+        lambda: admin_client.post(url, json.dumps({'users': identifiers[:1]}), content_type='application/json'),
+    )
+    recorder.measure(
+        'POST managers/lookup {} users'.format(len(identifiers)),
+        lambda: admin_client.post(url, json.dumps({'users': identifiers}), content_type='application/json'),
+        iterations=5,
+    )
+
+
+def test_export(admin_client, org, recorder):  # pylint: disable=unused-argument
+    url = reverse('user_manager_api:v1:user-managers-export')
+    recorder.measure(
+        'GET export',
+        lambda: b''.join(admin_client.get(url, {'export_format': 'ndjson'}).streaming_content),
+        iterations=3,
+    )
+
+
+def test_manager_role(org, recorder):
+    report = User.objects.get(id=org.report_id)
+    manager = User.objects.get(id=org.top_manager_id)
+    others = list(User.objects.filter(id__in=org.user_ids[:50]))
+    recorder.measure('ManagerRole.has_user', lambda: ManagerRole(report).has_user(manager), iterations=200)
+    recorder.measure('ManagerRole().has_user', lambda: ManagerRole().has_user(manager), iterations=200)
+    recorder.measure('ManagerRole.add_users', lambda: ManagerRole(report).add_users(*others), rollback=True)
+    recorder.measure('ManagerRole.remove_users', lambda: ManagerRole().remove_users(manager), rollback=True)
+    recorder.measure('ManagerRole.users_with_role', lambda: list(ManagerRole(report).users_with_role()))
+
+
+def test_registration_signal(org, recorder):
+    recorder.measure(
+        'User registration without invite',
+        lambda: User.objects.create(username='bench-new', email='bench-new@example.com'),
+        iterations=50,
+        rollback=True,
+    )
+    recorder.measure(
+        'User registration with invite',
+        lambda: User.objects.create(username='bench-invited', email=org.invite_email),
+        iterations=50,
+        rollback=True,
+    )
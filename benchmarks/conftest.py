@@ -0,0 +1,122 @@
+"""
+Fixtures for the User Manager Application benchmarks.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+import json
+import os
+import platform
+import timeit
+
+import pytest
+
+import django
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+import user_manager
+from user_manager.models import UserManagerRole
+from user_manager.synthetic import OrgShape, generate_org
+
+NUM_ROLES = int(os.environ.get('BENCHMARK_ROLES', 10000))
+SEED = int(os.environ.get('BENCHMARK_SEED', 0))
+ITERATIONS = int(os.environ.get('BENCHMARK_ITERATIONS', 20))
+OUTPUT = os.environ.get('BENCHMARK_OUTPUT', 'benchmark-results.json')
+
+
+class Org(object):
+    """
+    Sample users of the seeded organisation to run the benchmarks against.
+    """
+
+    def __init__(self, user_ids):
+        self.user_ids = user_ids
+        counts = UserManagerRole.objects.filter(manager_user__isnull=False).values(
+            'manager_user',
+        ).annotate(reports=Count('id')).order_by('-reports', 'manager_user')
+        self.top_manager_id = counts[0]['manager_user']
+        self.median_manager_id = counts[counts.count() // 2]['manager_user']
+        self.report_id = user_ids[-1]
+        self.invite_email = UserManagerRole.objects.filter(
+            manager_user__isnull=True,
+        ).values_list('unregistered_manager_email', flat=True).first()
+
+
+class Recorder(object):
+    """
+    Measures benchmark cases and writes the results to a JSON file.
+    """
+
+    def __init__(self):
+        self.results = []
+
+    def measure(self, name, func, iterations=ITERATIONS, rollback=False):
+        """
+        Call ``func`` ``iterations`` times, recording latency and query counts.
+
+        With ``rollback``, each call is rolled back so it sees the same data.
+        """
+        latencies = []
+        query_counts = []
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as queries:
+                start = timeit.default_timer()
+                if rollback:
+                    with transaction.atomic():
+                        func()
+                        transaction.set_rollback(True)
+                else:
+                    func()
+                latencies.append(timeit.default_timer() - start)
+            query_counts.append(len(queries))
+        latencies.sort()
+        result = {
+            'name': name,
+            'iterations': iterations,
+            'mean_ms': 1000 * sum(latencies) / iterations,
+            'p50_ms': 1000 * latencies[iterations // 2],
+            'p95_ms': 1000 * latencies[min(iterations - 1, int(iterations * 0.95))],
+            'max_ms': 1000 * latencies[-1],
+            'throughput_per_s': iterations / sum(latencies),
+            'queries': max(query_counts),
+        }
+        self.results.append(result)
+        return result
+
+    def write(self, path):
+        with open(path, 'w') as output:
+            json.dump({
+                'metadata': {
+                    'timestamp': datetime.datetime.utcnow().isoformat(),
+                    'version': user_manager.__version__,
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'database': connection.vendor,
+                    'roles': NUM_ROLES,
+                    'seed': SEED,
+                },
+                'results': self.results,
+            }, output, indent=2, sort_keys=True)
+
+
+@pytest.fixture(scope='session')
+def django_db_setup(django_db_setup, django_db_blocker):  # pylint: disable=redefined-outer-name,unused-argument
+    """
+    Seed the benchmark database with a synthetic organisation once per run.
+    """
+    with django_db_blocker.unblock():
+        return Org(generate_org(OrgShape(num_roles=NUM_ROLES, seed=SEED)))
+
+
+@pytest.fixture
+def org(django_db_setup, db):  # pylint: disable=redefined-outer-name,unused-argument
+    return django_db_setup
+
+
+@pytest.fixture(scope='session')
+def recorder():
+    bench_recorder = Recorder()
+    yield bench_recorder
+    bench_recorder.write(OUTPUT)
@@ -0,0 +1,26 @@
+"""
+Settings for running the benchmarks.
+
+SQLite is used by default. Set ``BENCHMARK_DATABASE_NAME`` (and optionally
+``BENCHMARK_DATABASE_USER``, ``BENCHMARK_DATABASE_PASSWORD``,
+``BENCHMARK_DATABASE_HOST`` and ``BENCHMARK_DATABASE_PORT``) to run them
+against PostgreSQL instead.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+
+from test_settings import *  # pylint: disable=wildcard-import,unused-wildcard-import
+
+if os.environ.get('BENCHMARK_DATABASE_NAME'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['BENCHMARK_DATABASE_NAME'],
+            'USER': os.environ.get('BENCHMARK_DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('BENCHMARK_DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('BENCHMARK_DATABASE_HOST', ''),
+            'PORT': os.environ.get('BENCHMARK_DATABASE_PORT', ''),
+        }
+    }
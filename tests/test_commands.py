@@ -0,0 +1,171 @@
+"""
+Tests for User Manager Application management commands
+"""
+from __future__ import absolute_import, unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+
+import ddt
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+
+from student.tests.factories import UserFactory
+from user_manager.hierarchy import rebuild_hierarchy
+from user_manager.invites import may_have_pending_invite
+from user_manager.models import ManagerSummary, UserManagerHierarchy, UserManagerRole
+from user_manager.summary import rebuild_manager_summaries
+from user_manager.synthetic import OrgShape, get_user_ids
+
+
+class ReconcileManagerInvitesTest(TestCase):
+    """
+    Tests for the reconcile_manager_invites command
+    """
+
+    def setUp(self):
+        self.users = [UserFactory() for _ in range(4)]
+        for user in self.users:
+            UserManagerRole.objects.create(user=user, unregistered_manager_email='Boss@Example.com')
+        UserManagerRole.objects.create(user=self.users[0], unregistered_manager_email='nobody@example.com')
+        # Created without sending post_save, so the invites are not upgraded.
+        User.objects.bulk_create([User(username='boss', email='boss@example.com')])
+        self.manager = User.objects.get(username='boss')
+        UserManagerRole.objects.create(user=self.users[1], manager_user=self.manager)
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command('reconcile_manager_invites', dry_run=True, batch_size=2, stdout=out)
+        self.assertIn('[dry run] Processed 5 invites: 3 upgraded, 1 duplicates removed, 1 unresolved', out.getvalue())
+        self.assertEqual(UserManagerRole.objects.filter(manager_user__isnull=True).count(), 5)
+
+    def test_reconcile(self):
+        call_command('reconcile_manager_invites', batch_size=2, stdout=StringIO())
+        for user in self.users:
+            self.assertTrue(UserManagerRole.objects.filter(user=user, manager_user=self.manager).exists())
+        self.assertEqual(
+            list(UserManagerRole.objects.filter(manager_user__isnull=True).values_list(
+                'unregistered_manager_email', flat=True,
+            )),
+            ['nobody@example.com'],
+        )
+
+    def test_reads_users_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            call_command('reconcile_manager_invites', dry_run=True, batch_size=1, stdout=StringIO())
+        user_table = connection.ops.quote_name(User._meta.db_table)
+        user_queries = [query['sql'] for query in queries.captured_queries if 'FROM {}'.format(user_table) in query['sql']]
+        self.assertEqual(len(user_queries), 1)
+
+
+@override_settings(USER_MANAGER_INVITE_FILTER_TIMEOUT=300)
+class BuildPendingInviteFilterTest(TestCase):
+    """
+    Tests for the build_pending_invite_filter command
+    """
+
+    def setUp(self):
+        cache.clear()
+        UserManagerRole.objects.create(user=UserFactory(), unregistered_manager_email='boss@example.com')
+
+    def test_build(self):
+        call_command('build_pending_invite_filter', stdout=StringIO())
+        self.assertTrue(may_have_pending_invite('boss@example.com'))
+        self.assertFalse(may_have_pending_invite('nobody@example.com'))
+
+    @override_settings(USER_MANAGER_INVITE_FILTER_TIMEOUT=0)
+    def test_disabled(self):
+        with self.assertRaises(CommandError):
+            call_command('build_pending_invite_filter', stdout=StringIO())
+
+
+@ddt.ddt
+class ExportUserManagersTest(TestCase):
+    """
+    Tests for the export_user_managers command
+    """
+
+    def setUp(self):
+        UserManagerRole.objects.create(
+            user=UserFactory(email='r\xe9port@example.com'),
+            unregistered_manager_email='boss@example.com',
+        )
+
+    @ddt.data('csv', 'ndjson')
+    def test_export_to_file(self, export_format):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        output = os.path.join(output_dir, 'managers.{}'.format(export_format))
+        call_command('export_user_managers', export_format=export_format, output=output)
+        with io.open(output, encoding='utf-8') as export:
+            lines = export.read().splitlines()
+        self.assertEqual(len(lines), 2 if export_format == 'csv' else 1)
+        self.assertIn('r\xe9port@example.com' if export_format == 'csv' else 'r\\u00e9port@example.com', lines[-1])
+
+    def test_export_to_stdout(self):
+        out = StringIO()
+        call_command('export_user_managers', stdout=out)
+        self.assertIn('r\xe9port@example.com', out.getvalue())
+
+
+class GenerateOrgChartTest(TestCase):
+    """
+    Tests for the generate_org_chart command
+    """
+
+    def _generate(self, prefix):
+        call_command(
+            'generate_org_chart',
+            roles=500,
+            depth=4,
+            unregistered_share=0.1,
+            seed=42,
+            prefix=prefix,
+            chunk_size=100,
+            stdout=StringIO(),
+        )
+        user_ids = get_user_ids(OrgShape(500, depth=4, prefix=prefix))
+        index = {user_id: position for position, user_id in enumerate(user_ids)}
+        return sorted(
+            (index[user_id], index.get(manager_id, -1), (email or '').replace(prefix, ''))
+            for user_id, manager_id, email in UserManagerRole.objects.filter(
+                user_id__in=user_ids,
+            ).values_list('user_id', 'manager_user_id', 'unregistered_manager_email')
+        )
+
+    def test_generate(self):
+        roles = self._generate('org-a')
+        self.assertGreater(len(roles), 450)
+        self.assertTrue(any(manager == -1 for _, manager, _ in roles))
+        # Managers are always on a higher level than their reports.
+        self.assertTrue(all(manager < user for user, manager, _ in roles))
+
+    def test_deterministic(self):
+        self.assertEqual(self._generate('org-a'), self._generate('org-b'))
+
+    @override_settings(USER_MANAGER_HIERARCHY_ENABLED=True, USER_MANAGER_SUMMARY_ENABLED=True)
+    def test_derived_data_rebuilt(self):
+        self._generate('org-a')
+        closure = set(UserManagerHierarchy.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+        summaries = set(ManagerSummary.objects.values_list(
+            'manager_user_id', 'unregistered_manager_email', 'report_count',
+        ))
+        self.assertNotEqual(closure, set())
+        rebuild_hierarchy()
+        rebuild_manager_summaries()
+        self.assertEqual(
+            set(UserManagerHierarchy.objects.values_list('ancestor_id', 'descendant_id', 'depth')),
+            closure,
+        )
+        self.assertEqual(
+            set(ManagerSummary.objects.values_list('manager_user_id', 'unregistered_manager_email', 'report_count')),
+            summaries,
+        )
@@ -0,0 +1,81 @@
+"""
+Tests for User Manager Application reporting hierarchy
+"""
+from __future__ import absolute_import, unicode_literals
+
+import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from student.tests.factories import UserFactory
+from user_manager.hierarchy import get_ancestors, get_descendants, is_ancestor, iter_subtree
+from user_manager.models import UserManagerHierarchy, UserManagerRole
+from user_manager.utils import bulk_create_user_manager_roles
+
+
+@override_settings(USER_MANAGER_HIERARCHY_ENABLED=True)
+class UserManagerHierarchyTest(TestCase):
+    """
+    Tests for the reporting hierarchy closure table
+    """
+
+    def setUp(self):
+        self.director = UserFactory()
+        self.manager = UserFactory()
+        self.reports = [UserFactory() for _ in range(3)]
+        UserManagerRole.objects.create(user=self.manager, manager_user=self.director)
+        for report in self.reports:
+            UserManagerRole.objects.create(user=report, manager_user=self.manager)
+
+    def _closure(self):
+        return set(UserManagerHierarchy.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+    def test_create(self):
+        self.assertTrue(is_ancestor(self.director, self.reports[0]))
+        self.assertFalse(is_ancestor(self.reports[0], self.director))
+        self.assertEqual(set(get_descendants(self.director)), set(self.reports + [self.manager]))
+        self.assertEqual(set(get_ancestors(self.reports[0])), {self.director, self.manager})
+        self.assertEqual(
+            UserManagerHierarchy.objects.get(ancestor=self.director, descendant=self.reports[0]).depth,
+            2,
+        )
+
+    def test_delete(self):
+        UserManagerRole.objects.filter(user=self.manager).delete()
+        self.assertFalse(is_ancestor(self.director, self.reports[0]))
+        self.assertTrue(is_ancestor(self.manager, self.reports[0]))
+
+    def test_upgrade_unregistered_manager(self):
+        UserManagerRole.objects.create(user=self.director, unregistered_manager_email='ceo@example.com')
+        ceo = UserFactory(email='ceo@example.com')
+        self.assertTrue(is_ancestor(ceo, self.reports[0]))
+        self.assertEqual(UserManagerHierarchy.objects.get(ancestor=ceo, descendant=self.reports[0]).depth, 3)
+
+    def test_bulk_create(self):
+        new_reports = [UserFactory() for _ in range(2)]
+        bulk_create_user_manager_roles(new_reports, manager_user=self.reports[0])
+        self.assertTrue(is_ancestor(self.director, new_reports[1]))
+
+    def test_cycle(self):
+        UserManagerRole.objects.create(user=self.director, manager_user=self.reports[0])
+        self.assertTrue(is_ancestor(self.reports[0], self.reports[1]))
+        self.assertFalse(
+            UserManagerHierarchy.objects.filter(ancestor=self.director, descendant=self.director).exists()
+        )
+
+    def test_rebuild(self):
+        expected = self._closure()
+        UserManagerHierarchy.objects.all().delete()
+        call_command('rebuild_user_manager_hierarchy', chunk_size=2)
+        self.assertEqual(self._closure(), expected)
+
+    def test_iter_subtree_chunked_cursor(self):
+        with mock.patch.object(connection, 'chunked_cursor', wraps=connection.chunked_cursor) as chunked_cursor:
+            subtree = list(iter_subtree(UserManagerRole.objects.filter(manager_user=self.director)))
+        chunked_cursor.assert_called_once_with()
+        self.assertEqual(
+            [(user_id, depth) for user_id, _, depth in subtree],
+            [(self.manager.id, 1)] + sorted((report.id, 2) for report in self.reports),
+        )
@@ -4,7 +4,7 @@ Tests for User Manager Application models
 from __future__ import absolute_import, unicode_literals
 
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from student.tests.factories import UserFactory
 from user_manager.models import UserManagerRole
@@ -31,8 +31,57 @@ class UserManagerRoleModelTest(TestCase):
 
         self.assertEqual(manager_role_2.manager_email, manager_email)
 
+    def test_normalize_unregistered_manager_email(self):
+        user = UserFactory(email='Report@Management.co')
+        role = UserManagerRole.objects.create(user=user, unregistered_manager_email=' Manager@Management.CO ')
+        self.assertEqual(role.unregistered_manager_email, 'manager@management.co')
+
+        with self.assertRaises(ValidationError):
+            UserManagerRole.objects.create(user=user, unregistered_manager_email='report@management.co')
+
     def test_disallow_user_equal_manager(self):
         user = UserFactory()
 
         with self.assertRaises(ValidationError):
             UserManagerRole.objects.create(user=user, manager_user=user)
+
+    @override_settings(USER_MANAGER_FAST_WRITES=True)
+    def test_fast_writes(self):
+        user = UserFactory()
+        manager = UserFactory()
+
+        with self.assertNumQueries(3):  # savepoint, insert, release savepoint
+            UserManagerRole.objects.create(user=user, manager_user=manager)
+
+        with self.assertRaises(ValidationError):
+            UserManagerRole.objects.create(user=user, manager_user=manager)
+
+        with self.assertRaises(ValidationError):
+            UserManagerRole.objects.create(user=user, manager_user=user)
+
+        with self.assertRaises(ValidationError):
+            UserManagerRole.objects.create(user=user, unregistered_manager_email=user.email)
+
+    @override_settings(USER_MANAGER_FAST_WRITES=True)
+    def test_fast_writes_invite_by_user_id(self):
+        user = UserFactory()
+
+        # The user is not loaded to compare its email.
+        with self.assertNumQueries(3):  # savepoint, insert, release savepoint
+            UserManagerRole.objects.create(user_id=user.id, unregistered_manager_email='manager@management.co')
+
+    @override_settings(USER_MANAGER_FAST_WRITES=True, USER_MANAGER_SUMMARY_ENABLED=True)
+    def test_fast_writes_with_summary(self):
+        user = UserFactory()
+        other_user = UserFactory()
+        manager = UserFactory()
+        UserManagerRole.objects.create(user=other_user, manager_user=manager)
+
+        with self.assertNumQueries(4):  # savepoint, insert, summary update, release savepoint
+            UserManagerRole.objects.create(user=user, manager_user=manager)
+
+    def test_require_one_manager(self):
+        user = UserFactory()
+
+        with self.assertRaises(ValidationError):
+            UserManagerRole.objects.create(user=user)
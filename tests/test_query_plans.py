@@ -0,0 +1,367 @@
+"""
+Query plan regression tests for User Manager Application
+
+Every statement that the package runs against its own tables is captured,
+explained, and checked for full scans and sorts of large tables, against a
+seeded synthetic organisation. The tests run on SQLite by default and on
+PostgreSQL with ``make query-plans`` (see ``docs/testing.rst``).
+"""
+from __future__ import absolute_import, unicode_literals
+
+import json
+import os
+import re
+from contextlib import contextmanager
+from unittest import skipUnless
+
+import mock
+from rest_framework.request import Request
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.backends.utils import CursorWrapper
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from student.tests.factories import UserFactory
+from user_manager.api.v1.views import ManagerListView, ManagerReportsListView, UserManagerListView
+from user_manager.models import ManagerSummary, UserManagerRole
+from user_manager.roles import ManagerRole
+from user_manager.synthetic import OrgShape, generate_org
+
+PLAN_ROLES = int(os.environ.get('QUERY_PLAN_ROLES', 3000))
+# Full scans and sorts of tables with more rows than this fail.
+SIZE_THRESHOLD = int(os.environ.get('QUERY_PLAN_SIZE_THRESHOLD', 1000))
+PACKAGE_TABLES = frozenset(model._meta.db_table for model in apps.get_app_config('user_manager').get_models())
+CHECKED_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE')
+TABLE_ALIAS_RE = re.compile(r'(?:FROM|JOIN|UPDATE)\s+"(\w+)"(?:\s+([A-Z]\d+)\b)?')
+FULL_INDEX_SCANS = ('Index Scan', 'Index Only Scan')
+SORTS = ('Sort', 'Incremental Sort')
+
+
+@contextmanager
+def record_statements():
+    """
+    Record the ``(sql, params)`` of every statement executed inside the block.
+    """
+    statements = []
+    execute = CursorWrapper.execute
+
+    def recording_execute(cursor, sql, params=None):
+        statements.append((sql, params))
+        return execute(cursor, sql, params)
+
+    with mock.patch.object(CursorWrapper, 'execute', recording_execute):
+        yield statements
+
+
+def is_checked(sql):
+    """
+    Return whether ``sql`` is a statement on the package's tables to check.
+    """
+    return sql.lstrip().upper().startswith(CHECKED_STATEMENTS) and any(
+        '"{}"'.format(table) in sql for table in PACKAGE_TABLES
+    )
+
+
+def explain_queryset(queryset):
+    """
+    Return the details of each step of the SQLite query plan of ``queryset``.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class TableSizes(object):
+    """
+    Counts the rows of tables, once each.
+    """
+
+    def __init__(self):
+        self.sizes = {}
+
+    def is_large(self, table):
+        if table not in self.sizes:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM {}'.format(connection.ops.quote_name(table)))
+                self.sizes[table] = cursor.fetchone()[0]
+        return self.sizes[table] > SIZE_THRESHOLD
+
+
+def sqlite_plan_problems(sql, params, sizes, allowed_scans):
+    """
+    Return the problems in the SQLite query plan of ``sql``.
+
+    SQLite doesn't estimate how many rows are sorted, so a temporary B-tree
+    is a problem when the outer query also scans a large table, rather than
+    only sorting rows found through indexes. Scans and sorts of
+    ``allowed_scans`` are allowed.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        rows = cursor.fetchall()
+    aliases = {}
+    for table, alias in TABLE_ALIAS_RE.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    parents = {row[0]: row[1] for row in rows}
+    details = {row[0]: row[-1] for row in rows}
+
+    def in_subquery(row_id):
+        while row_id in parents:
+            row_id = parents[row_id]
+            if 'SUBQUERY' in details.get(row_id, ''):
+                return True
+        return False
+
+    problems = []
+    large_outer_scan = False
+    for row_id, _, _, detail in rows:
+        words = detail.split()
+        if words[0] != 'SCAN' or len(words) < 2:
+            continue
+        table = aliases.get(words[2] if words[1] == 'TABLE' else words[1])
+        if table is None or table in allowed_scans or not sizes.is_large(table):
+            continue
+        if not in_subquery(row_id):
+            large_outer_scan = True
+        if table in PACKAGE_TABLES:
+            problems.append('Full scan of {}: {}'.format(table, detail))
+    if large_outer_scan and any('TEMP B-TREE' in detail for detail in details.values()):
+        problems.append('Sort of a scanned large table')
+    return problems
+
+
+def _plan_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        for descendant in _plan_nodes(child):
+            yield descendant
+
+
+def _is_full_scan(node):
+    node_type = node['Node Type']
+    return node_type == 'Seq Scan' or (node_type in FULL_INDEX_SCANS and 'Index Cond' not in node)
+
+
+def postgresql_plan_problems(sql, params, sizes, allowed_scans):
+    """
+    Return the problems in the PostgreSQL query plan of ``sql``.
+
+    Sorts of more rows than the size threshold are problems, unless they
+    sort a full scan of one of ``allowed_scans``.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+    problems = []
+    for node in _plan_nodes(plan[0]['Plan']):
+        table = node.get('Relation Name')
+        if _is_full_scan(node) and table in PACKAGE_TABLES and table not in allowed_scans and sizes.is_large(table):
+            problems.append('{} of {}'.format(node['Node Type'], table))
+        if node['Node Type'] in SORTS and node['Plan Rows'] > SIZE_THRESHOLD:
+            sorted_scans = set(
+                descendant.get('Relation Name') for descendant in _plan_nodes(node) if _is_full_scan(descendant)
+            )
+            if not sorted_scans & set(allowed_scans):
+                problems.append('Sort of {} rows'.format(node['Plan Rows']))
+    return problems
+
+
+PLAN_CHECKERS = {
+    'sqlite': sqlite_plan_problems,
+    'postgresql': postgresql_plan_problems,
+}
+
+
+@skipUnless(connection.vendor in PLAN_CHECKERS, 'Query plans are only checked on SQLite and PostgreSQL')
+@override_settings(USER_MANAGER_SUMMARY_ENABLED=True)
+class QueryPlanTestCase(TestCase):
+    """
+    Base class for checking query plans against a synthetic organisation,
+    with the manager summary table enabled.
+
+    The plans of the managers list are only free of full scans with the
+    summary table; without it, the list reads the whole role table.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user_ids = generate_org(OrgShape(num_roles=PLAN_ROLES, prefix='plan'))
+        if connection.vendor == 'postgresql':
+            # Statistics of the rows inserted in this transaction.
+            with connection.cursor() as cursor:
+                for table in PACKAGE_TABLES | {User._meta.db_table}:
+                    cursor.execute('ANALYZE {}'.format(connection.ops.quote_name(table)))
+        cls.manager = User.objects.get(id=ManagerSummary.objects.filter(
+            manager_user__isnull=False,
+        ).order_by('-report_count', 'id').values_list('manager_user_id', flat=True)[0])
+        cls.report = User.objects.get(id=UserManagerRole.objects.filter(
+            manager_user=cls.manager,
+        ).values_list('user_id', flat=True)[0])
+        cls.invite_email = UserManagerRole.objects.filter(
+            manager_user__isnull=True,
+        ).values_list('unregistered_manager_email', flat=True)[0]
+        cls.staff = UserFactory(username='plan-staff', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.login(username=self.staff.username, password='test')
+
+    def assertIndexedPlans(self, func, allowed_scans=()):
+        """
+        Run ``func`` and check the plans of the statements it ran on the
+        package's tables. ``allowed_scans`` are tables expected to be read
+        in full.
+        """
+        with record_statements() as statements:
+            func()
+        checked = [(sql, params) for sql, params in statements if is_checked(sql)]
+        self.assertNotEqual(checked, [], 'No statements on user_manager tables were run.')
+        sizes = TableSizes()
+        problems = []
+        for sql, params in checked:
+            for problem in PLAN_CHECKERS[connection.vendor](sql, params, sizes, allowed_scans):
+                problems.append('{}\n    {}'.format(problem, sql))
+        self.assertEqual(problems, [], '\n'.join(problems))
+
+
+class PackageQueryPlanTest(QueryPlanTestCase):
+    """
+    Check the plans of every kind of query the package runs
+    """
+
+    def _get(self, url_name, username=None):
+        kwargs = {'username': username} if username is not None else {}
+        response = self.client.get(reverse('user_manager_api:v1:{}'.format(url_name), kwargs=kwargs))
+        self.assertEqual(response.status_code, 200)
+
+    def _delete(self, url_name, username, **params):
+        url = reverse('user_manager_api:v1:{}'.format(url_name), kwargs={'username': username})
+        response = self.client.delete('{}?{}'.format(url, '&'.join('{}={}'.format(*item) for item in params.items())))
+        self.assertEqual(response.status_code, 204)
+
+    def test_managers_list(self):
+        # The summary table is read a page at a time in primary key order,
+        # and counted for page number pagination.
+        self.assertIndexedPlans(
+            lambda: self._get('managers-list'),
+            allowed_scans={ManagerSummary._meta.db_table},
+        )
+
+    @override_settings(USER_MANAGER_SUMMARY_ENABLED=False)
+    def test_managers_list_without_summary(self):
+        # Without the summary table every role is read and grouped by manager,
+        # which is why large deployments should enable it.
+        self.assertIndexedPlans(
+            lambda: self._get('managers-list'),
+            allowed_scans={UserManagerRole._meta.db_table},
+        )
+
+    def test_manager_reports_list(self):
+        self.assertIndexedPlans(lambda: self._get('manager-reports-list', self.manager.username))
+        self.assertIndexedPlans(lambda: self._get('manager-reports-list', self.manager.email))
+        self.assertIndexedPlans(lambda: self._get('manager-reports-list', self.invite_email))
+
+    def test_user_managers_list(self):
+        self.assertIndexedPlans(lambda: self._get('user-managers-list', self.report.username))
+        self.assertIndexedPlans(lambda: self._get('user-managers-list', self.report.email))
+
+    def test_manager_reports_delete(self):
+        self.assertIndexedPlans(
+            lambda: self._delete('manager-reports-list', self.manager.username, user=self.report.email),
+        )
+        self.assertIndexedPlans(lambda: self._delete('manager-reports-list', self.invite_email))
+
+    def test_user_managers_delete(self):
+        self.assertIndexedPlans(
+            lambda: self._delete('user-managers-list', self.report.username, manager=self.manager.email),
+        )
+
+    def test_has_user(self):
+        self.assertIndexedPlans(lambda: ManagerRole(self.report).has_user(self.manager))
+        with override_settings(USER_MANAGER_ROLE_CACHE_TIMEOUT=0):
+            self.assertIndexedPlans(lambda: ManagerRole(self.report).has_user(self.manager))
+            self.assertIndexedPlans(lambda: ManagerRole().has_user(self.manager))
+
+    def test_users_with_role(self):
+        self.assertIndexedPlans(lambda: list(ManagerRole(self.report).users_with_role()))
+        # Listing every manager at once reads every user; iter_managers reads
+        # them in chunks instead.
+        self.assertIndexedPlans(
+            lambda: list(ManagerRole().users_with_role()),
+            allowed_scans={User._meta.db_table, UserManagerRole._meta.db_table},
+        )
+        self.assertIndexedPlans(lambda: list(ManagerRole().iter_managers()))
+
+    def test_invite_upgrade(self):
+        self.assertIndexedPlans(lambda: UserFactory(email=self.invite_email))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are only explained on SQLite')
+class ListQueryPlanTest(TestCase):
+    """
+    Check that the list views read the role table through its indexes
+    """
+
+    def setUp(self):
+        self.manager = UserFactory(email='manager@somecorp.com')
+        self.user = UserFactory(email='report@somecorp.com')
+        UserManagerRole.objects.create(user=self.user, manager_user=self.manager)
+        UserManagerRole.objects.create(user=self.user, unregistered_manager_email='invited@somecorp.com')
+
+    def _get_queryset(self, view_class, **kwargs):
+        view = view_class()
+        view.request = Request(RequestFactory().get('/'))
+        view.kwargs = kwargs
+        view.format_kwarg = None
+        return view.get_queryset()
+
+    def assertNoScan(self, plan, table=UserManagerRole._meta.db_table):
+        scans = [detail for detail in plan if detail.startswith('SCAN') and table in detail]
+        self.assertEqual(scans, [], plan)
+
+    def assertNoSort(self, plan):
+        sorts = [detail for detail in plan if 'TEMP B-TREE' in detail]
+        self.assertEqual(sorts, [], plan)
+
+    def test_manager_reports_by_username(self):
+        plan = explain_queryset(self._get_queryset(ManagerReportsListView, username=self.manager.username))
+        self.assertNoScan(plan)
+        self.assertNoSort(plan)
+
+    def test_user_managers_by_username(self):
+        plan = explain_queryset(self._get_queryset(UserManagerListView, username=self.user.username))
+        self.assertNoScan(plan)
+        self.assertNoSort(plan)
+
+    def test_invite_reports(self):
+        plan = explain_queryset(self._get_queryset(ManagerReportsListView, username='invited@somecorp.com'))
+        # Registered and invited reports come from two indexes, so only the
+        # reports of this manager are sorted.
+        self.assertNoScan(plan)
+
+    def test_user_managers_by_email(self):
+        plan = explain_queryset(self._get_queryset(UserManagerListView, username=self.user.email))
+        self.assertNoScan(plan)
+
+    @override_settings(USER_MANAGER_SUMMARY_ENABLED=True)
+    def test_managers(self):
+        # Only the summary table lists managers without reading every role.
+        plan = explain_queryset(self._get_queryset(ManagerListView))
+        self.assertNoSort(plan)
+        self.assertNoScan(plan, User._meta.db_table)
+
+    def test_managers_without_summary(self):
+        # Managers are grouped from all of the roles, but their users are
+        # still found by primary key.
+        plan = explain_queryset(self._get_queryset(ManagerListView))
+        self.assertNoScan(plan, User._meta.db_table)
@@ -0,0 +1,209 @@
+"""
+Tests for User Manager Application roles
+"""
+from __future__ import absolute_import, unicode_literals
+
+import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from student.tests.factories import UserFactory
+from user_manager.memo import memoize_manager_roles
+from user_manager.models import UserManagerRole
+from user_manager.roles import ManagerRole, filter_managed_users, managed_user_ids
+
+
+@override_settings(USER_MANAGER_ROLE_CACHE_TIMEOUT=300)
+class ManagerRoleCacheTest(TransactionTestCase):
+    """
+    Tests for caching of ManagerRole lookups
+
+    These run outside a transaction, as managers with uncommitted changes
+    are not cached.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory()
+        self.manager = UserFactory()
+        self.other = UserFactory()
+        UserManagerRole.objects.create(user=self.user, manager_user=self.manager)
+        UserManagerRole.objects.create(user=self.user, unregistered_manager_email='invite@example.com')
+
+    def test_has_user_cached(self):
+        role = ManagerRole(self.user)
+        with self.assertNumQueries(1):
+            self.assertTrue(role.has_user(self.manager))
+            self.assertFalse(role.has_user(self.other))
+        with self.assertNumQueries(0):
+            self.assertTrue(ManagerRole(self.user).has_user(self.manager))
+
+    def test_invalidated_on_save_and_delete(self):
+        role = ManagerRole(self.user)
+        self.assertFalse(role.has_user(self.other))
+        UserManagerRole.objects.create(user=self.user, manager_user=self.other)
+        self.assertTrue(role.has_user(self.other))
+        UserManagerRole.objects.filter(user=self.user, manager_user=self.other).delete()
+        self.assertFalse(role.has_user(self.other))
+
+    def test_invalidated_on_upgrade(self):
+        role = ManagerRole(self.user)
+        self.assertFalse(role.has_user(self.other))
+        invited = UserFactory(email='invite@example.com')
+        with self.assertNumQueries(1):
+            self.assertTrue(role.has_user(invited))
+
+    def test_rolled_back_role_not_cached(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                UserManagerRole.objects.create(user=self.user, manager_user=self.other)
+                self.assertTrue(ManagerRole(self.user).has_user(self.other))
+                raise RuntimeError
+        self.assertFalse(UserManagerRole.objects.filter(user=self.user, manager_user=self.other).exists())
+        self.assertFalse(ManagerRole(self.user).has_user(self.other))
+
+    def test_cached_after_rolled_back_savepoint(self):
+        with transaction.atomic():
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    UserManagerRole.objects.create(user=self.user, manager_user=self.other)
+                    raise RuntimeError
+            self.assertTrue(ManagerRole(self.user).has_user(self.manager))
+        with self.assertNumQueries(0):
+            self.assertTrue(ManagerRole(self.user).has_user(self.manager))
+
+    @override_settings(USER_MANAGER_ROLE_CACHE_TIMEOUT=0)
+    def test_cache_disabled(self):
+        role = ManagerRole(self.user)
+        self.assertTrue(role.has_user(self.manager))
+        with self.assertNumQueries(1):
+            self.assertTrue(role.has_user(self.manager))
+
+
+@override_settings(USER_MANAGER_ROLE_CACHE_TIMEOUT=0)
+class ManagerRoleMemoTest(TestCase):
+    """
+    Tests for request-scoped memoization of ManagerRole lookups
+    """
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.manager = UserFactory()
+        UserManagerRole.objects.create(user=self.user, manager_user=self.manager)
+
+    def test_memoized_within_block(self):
+        with memoize_manager_roles() as memo:
+            with self.assertNumQueries(1):
+                for _ in range(5):
+                    self.assertTrue(ManagerRole(self.user).has_user(self.manager))
+        self.assertEqual(memo.hits, 4)
+        self.assertEqual(memo.misses, 1)
+        with self.assertNumQueries(2):
+            ManagerRole(self.user).has_user(self.manager)
+            ManagerRole(self.user).has_user(self.manager)
+
+    def test_cleared_on_change(self):
+        with memoize_manager_roles():
+            role = ManagerRole(self.user)
+            self.assertTrue(role.has_user(self.manager))
+            role.remove_users(self.manager)
+            self.assertFalse(role.has_user(self.manager))
+
+
+class ManagerRoleBulkTest(TestCase):
+    """
+    Tests for set-based ManagerRole writes
+    """
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.managers = [UserFactory() for _ in range(3)]
+        UserManagerRole.objects.create(user=self.user, manager_user=self.managers[0])
+
+    def test_add_users_skips_existing(self):
+        created = ManagerRole(self.user).add_users(*self.managers)
+        self.assertEqual(set(role.manager_user_id for role in created), {m.pk for m in self.managers[1:]})
+        self.assertEqual(UserManagerRole.objects.filter(user=self.user).count(), 3)
+
+    def test_add_direct_report(self):
+        reports = [UserFactory() for _ in range(3)]
+        created = ManagerRole(self.user).add_direct_report(self.user, *reports)
+        self.assertEqual(len(created), 3)
+        self.assertEqual(ManagerRole(self.user).add_direct_report(*reports), [])
+
+    def test_remove_users(self):
+        ManagerRole(self.user).add_users(*self.managers)
+        ManagerRole(self.user).remove_users(*self.managers[:2])
+        self.assertEqual(
+            list(UserManagerRole.objects.filter(user=self.user).values_list('manager_user_id', flat=True)),
+            [self.managers[2].pk],
+        )
+
+
+class FilterManagedUsersTest(TestCase):
+    """
+    Tests for checking which of many users a manager manages
+    """
+
+    def setUp(self):
+        self.manager = UserFactory(email='boss@example.com')
+        self.reports = [UserFactory() for _ in range(3)]
+        UserManagerRole.objects.create(user=self.reports[0], manager_user=self.manager)
+        UserManagerRole.objects.create(user=self.reports[1], unregistered_manager_email=self.manager.email)
+        UserManagerRole.objects.create(user=self.reports[2], manager_user=UserFactory())
+        self.user_ids = [user.id for user in self.reports]
+
+    def test_filter_managed_users(self):
+        with self.assertNumQueries(1):
+            managed = filter_managed_users(self.manager, self.user_ids)
+        self.assertEqual(managed, {self.reports[0].id, self.reports[1].id})
+
+    @mock.patch('user_manager.roles.LOOKUP_CHUNK_SIZE', 1)
+    def test_filter_many_managed_users(self):
+        with self.assertNumQueries(1):
+            managed = filter_managed_users(self.manager, self.user_ids[1:])
+        self.assertEqual(managed, {self.reports[1].id})
+
+    def test_filter_no_users(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(filter_managed_users(self.manager, []), set())
+
+    def test_managed_user_ids_subquery(self):
+        with self.assertNumQueries(1):
+            users = list(User.objects.filter(id__in=managed_user_ids(self.manager)).order_by('id'))
+        self.assertEqual(users, self.reports[:2])
+
+
+class ManagerRoleUsersTest(TestCase):
+    """
+    Tests for listing the managers of a user
+    """
+
+    def setUp(self):
+        self.users = [UserFactory() for _ in range(2)]
+        self.managers = [UserFactory() for _ in range(3)]
+        for manager in self.managers[:2]:
+            for user in self.users:
+                UserManagerRole.objects.create(user=user, manager_user=manager)
+        UserManagerRole.objects.create(user=self.users[0], manager_user=self.managers[2])
+        UserManagerRole.objects.create(user=self.users[1], unregistered_manager_email='invite@example.com')
+
+    def test_users_with_role(self):
+        with self.assertNumQueries(1):
+            managers = set(ManagerRole(self.users[1]).users_with_role())
+        self.assertEqual(managers, set(self.managers[:2]))
+
+    def test_all_users_with_role(self):
+        with self.assertNumQueries(1):
+            managers = list(ManagerRole().get_managers())
+        self.assertEqual(sorted(managers, key=lambda user: user.id), self.managers)
+
+    def test_iter_managers(self):
+        self.assertEqual(list(ManagerRole().iter_managers(chunk_size=2)), self.managers)
+        self.assertEqual(
+            sorted(ManagerRole(self.users[0]).iter_managers(), key=lambda user: user.id),
+            self.managers,
+        )
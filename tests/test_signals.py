@@ -3,14 +3,23 @@ Tests for User Manager Application signals
 """
 from __future__ import absolute_import, unicode_literals
 
+import ddt
 import mock
 
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from student.tests.factories import UserFactory
+from user_manager.invites import VERSION_CACHE_KEY, build_pending_invite_filter, may_have_pending_invite
 from user_manager.models import UserManagerRole
+from user_manager.signals import remember_previous_manager, upgrade_manager_role_entry
+from user_manager.utils import defer_manager_invite_upgrades, upgrade_manager_invites
 
 
+@ddt.ddt
 class UserManagerRoleSignalsTest(TestCase):
     """
     Tests for User Manager Application signals
@@ -46,3 +55,134 @@ class UserManagerRoleSignalsTest(TestCase):
         self.assertEqual(user_manager_role.manager_user, manager)
 
         mock_upgrade_manager_role_entry.assert_called()
+
+    def test_upgrade_user_manager_role_email_case(self):
+        manager = UserFactory(email='Manager@Management.co')
+        self.assertEqual(UserManagerRole.objects.get(user=self.user).manager_user, manager)
+
+    @ddt.data((False, False, 0), (True, False, 1), (False, True, 1))
+    @ddt.unpack
+    def test_previous_manager_read(self, summary_enabled, etags_enabled, num_queries):
+        role = UserManagerRole.objects.get(user=self.user)
+        with override_settings(USER_MANAGER_SUMMARY_ENABLED=summary_enabled, USER_MANAGER_ETAGS_ENABLED=etags_enabled):
+            with self.assertNumQueries(num_queries):
+                remember_previous_manager(UserManagerRole, role)
+
+
+@override_settings(USER_MANAGER_INVITE_FILTER_TIMEOUT=300)
+class PendingInviteFilterTest(TestCase):
+    """
+    Tests for skipping invite upgrades of users without a pending invite
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory()
+        UserManagerRole.objects.create(
+            user=self.user,
+            unregistered_manager_email='manager@management.co',
+        )
+        build_pending_invite_filter()
+
+    def test_filter(self):
+        self.assertTrue(may_have_pending_invite('manager@management.co'))
+        self.assertTrue(may_have_pending_invite('Manager@Management.co'))
+        self.assertFalse(may_have_pending_invite('nobody@management.co'))
+
+    def test_invite_created_after_filter_built(self):
+        self.assertFalse(may_have_pending_invite('late@management.co'))
+        UserManagerRole.objects.create(user=self.user, unregistered_manager_email='late@management.co')
+        self.assertTrue(may_have_pending_invite('late@management.co'))
+        self.assertTrue(may_have_pending_invite('nobody@management.co'))
+        manager = UserFactory(email='late@management.co')
+        self.assertTrue(UserManagerRole.objects.filter(user=self.user, manager_user=manager).exists())
+
+    def test_version_evicted_twice(self):
+        cache.delete(VERSION_CACHE_KEY)
+        UserManagerRole.objects.create(user=self.user, unregistered_manager_email='early@management.co')
+        build_pending_invite_filter()
+        self.assertFalse(may_have_pending_invite('late@management.co'))
+        cache.delete(VERSION_CACHE_KEY)
+        UserManagerRole.objects.create(user=self.user, unregistered_manager_email='late@management.co')
+        self.assertTrue(may_have_pending_invite('late@management.co'))
+
+    def test_filter_kept_in_process(self):
+        self.assertFalse(may_have_pending_invite('nobody@management.co'))
+        with mock.patch.object(cache, 'get', wraps=cache.get) as cache_get:
+            self.assertFalse(may_have_pending_invite('nobody@management.co'))
+        self.assertEqual([call[0][0] for call in cache_get.call_args_list], [VERSION_CACHE_KEY])
+
+    def test_not_built_in_request(self):
+        cache.clear()
+        with self.assertNumQueries(0):
+            self.assertTrue(may_have_pending_invite('nobody@management.co'))
+
+    @override_settings(USER_MANAGER_INVITE_FILTER_MAX_BYTES=10)
+    def test_filter_too_large(self):
+        cache.clear()
+        self.assertIsNone(build_pending_invite_filter())
+        self.assertTrue(may_have_pending_invite('nobody@management.co'))
+
+    def test_registration_without_invite_skips_database(self):
+        user = UserFactory.build(email='uninvited@management.co')
+        user.save()
+        with self.assertNumQueries(0):
+            upgrade_manager_role_entry(sender=User, instance=user, created=True)
+
+
+class DeferredInviteUpgradeTest(TestCase):
+    """
+    Tests for coalescing invite upgrades during bulk registration
+    """
+
+    def setUp(self):
+        self.users = [UserFactory() for _ in range(3)]
+        for idx, user in enumerate(self.users):
+            UserManagerRole.objects.create(
+                user=user,
+                unregistered_manager_email='manager{}@management.co'.format(idx),
+            )
+
+    def test_deferred_upgrades(self):
+        with defer_manager_invite_upgrades():
+            managers = [UserFactory(email='Manager{}@Management.co'.format(idx)) for idx in range(3)]
+            self.assertEqual(UserManagerRole.objects.filter(manager_user__isnull=False).count(), 0)
+        for user, manager in zip(self.users, managers):
+            self.assertTrue(UserManagerRole.objects.filter(user=user, manager_user=manager).exists())
+        self.assertFalse(UserManagerRole.objects.filter(unregistered_manager_email__isnull=False).exists())
+
+    def test_deferred_upgrades_applied_when_block_raises(self):
+        with self.assertRaises(ValueError):
+            with defer_manager_invite_upgrades():
+                manager = UserFactory(email='manager0@management.co')
+                with transaction.atomic():
+                    UserFactory(email='manager1@management.co')
+                    raise ValueError
+        self.assertTrue(UserManagerRole.objects.filter(user=self.users[0], manager_user=manager).exists())
+        self.assertEqual(
+            set(UserManagerRole.objects.filter(
+                unregistered_manager_email__isnull=False,
+            ).values_list('unregistered_manager_email', flat=True)),
+            {'manager1@management.co', 'manager2@management.co'},
+        )
+
+    def test_upgrade_does_not_depend_on_assignment_order(self):
+        UserManagerRole.objects.create(user=self.users[1], unregistered_manager_email='manager0@management.co')
+        # Created without signals, so the invites are only upgraded below.
+        User.objects.bulk_create([
+            User(username='manager{}'.format(idx), email='Manager{}@Management.co'.format(idx)) for idx in range(2)
+        ])
+        managers = list(User.objects.filter(username__in=['manager0', 'manager1']).order_by('username'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(upgrade_manager_invites([manager.email for manager in managers]), 3)
+        role_updates = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE') and UserManagerRole._meta.db_table in query['sql'].split(' SET ')[0]
+        ]
+        # The manager is chosen by primary key, not by the email cleared in the same UPDATE.
+        self.assertNotIn('unregistered_manager_email', role_updates[0].split('CASE', 1)[1].split('END', 1)[0])
+        self.assertEqual(
+            set(UserManagerRole.objects.values_list('user_id', 'manager_user_id')),
+            {(self.users[0].id, managers[0].id), (self.users[1].id, managers[1].id),
+             (self.users[1].id, managers[0].id), (self.users[2].id, None)},
+        )
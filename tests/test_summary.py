@@ -0,0 +1,85 @@
+"""
+Tests for User Manager Application manager summaries
+"""
+from __future__ import absolute_import, unicode_literals
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from student.tests.factories import UserFactory
+from user_manager.models import ManagerSummary, UserManagerRole
+from user_manager.utils import bulk_create_user_manager_roles, delete_user_manager_roles
+
+
+@override_settings(USER_MANAGER_SUMMARY_ENABLED=True)
+class ManagerSummaryTest(TestCase):
+    """
+    Tests for keeping ``ManagerSummary`` in sync with ``UserManagerRole``
+    """
+
+    def setUp(self):
+        self.manager = UserFactory()
+        self.reports = [UserFactory() for _ in range(3)]
+        for report in self.reports[:2]:
+            UserManagerRole.objects.create(user=report, manager_user=self.manager)
+        UserManagerRole.objects.create(user=self.reports[2], unregistered_manager_email='invited@somecorp.com')
+
+    def _summaries(self):
+        return set(ManagerSummary.objects.values_list(
+            'manager_user_id', 'unregistered_manager_email', 'report_count',
+        ))
+
+    def test_create_and_delete(self):
+        self.assertEqual(self._summaries(), {
+            (self.manager.id, None, 2),
+            (None, 'invited@somecorp.com', 1),
+        })
+        UserManagerRole.objects.get(user=self.reports[0]).delete()
+        delete_user_manager_roles(UserManagerRole.objects.filter(manager_user__isnull=True))
+        self.assertEqual(self._summaries(), {(self.manager.id, None, 1)})
+
+    def test_bulk_create_keeps_position(self):
+        other_manager = UserFactory()
+        bulk_create_user_manager_roles(self.reports, manager_user=other_manager)
+        summary_id = ManagerSummary.objects.get(manager_user=self.manager).id
+        bulk_create_user_manager_roles(self.reports, manager_user=self.manager)
+        summary = ManagerSummary.objects.get(manager_user=self.manager)
+        self.assertEqual(summary.id, summary_id)
+        self.assertEqual(summary.report_count, 3)
+        self.assertEqual(ManagerSummary.objects.get(manager_user=other_manager).report_count, 3)
+
+    def test_invite_upgrade(self):
+        manager = UserFactory(email='invited@somecorp.com')
+        self.assertEqual(self._summaries(), {
+            (self.manager.id, None, 2),
+            (manager.id, None, 1),
+        })
+
+    def test_counts_applied_as_deltas(self):
+        # Stands in for a report added by a concurrent transaction.
+        ManagerSummary.objects.filter(manager_user=self.manager).update(report_count=5)
+        UserManagerRole.objects.create(user=self.reports[2], manager_user=self.manager)
+        self.assertEqual(ManagerSummary.objects.get(manager_user=self.manager).report_count, 6)
+
+    def test_change_manager(self):
+        role = UserManagerRole.objects.get(user=self.reports[2])
+        role.unregistered_manager_email = None
+        role.manager_user = self.manager
+        role.save()
+        self.assertEqual(self._summaries(), {(self.manager.id, None, 3)})
+        role.save()
+        self.assertEqual(self._summaries(), {(self.manager.id, None, 3)})
+
+    @override_settings(USER_MANAGER_SUMMARY_ENABLED=False)
+    def test_disabled(self):
+        other_manager = UserFactory()
+        UserManagerRole.objects.create(user=self.reports[0], manager_user=other_manager)
+        self.assertFalse(ManagerSummary.objects.filter(manager_user=other_manager).exists())
+
+    def test_rebuild(self):
+        ManagerSummary.objects.all().delete()
+        call_command('rebuild_manager_summaries', chunk_size=1)
+        self.assertEqual(self._summaries(), {
+            (self.manager.id, None, 2),
+            (None, 'invited@somecorp.com', 1),
+        })
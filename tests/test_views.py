@@ -6,12 +6,21 @@ from __future__ import absolute_import, unicode_literals
 import json
 
 import ddt
+import mock
 
-from django.test import Client, TestCase
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from student.tests.factories import UserFactory
+from user_manager.api.v1.serializers import MAX_LOOKUP_USERS
+from user_manager.hierarchy import rebuild_hierarchy
+from user_manager.instrumentation import MemorySink, StatsdSink
 from user_manager.models import UserManagerRole
+from user_manager.summary import rebuild_manager_summaries
+from user_manager.utils import get_managers_for_users
 
 
 @ddt.ddt
@@ -53,6 +62,78 @@ class UserManagerRoleViewsTest(TestCase):
         results = data['results']
         self.assertEqual(len(results), 2)
 
+    @override_settings(USER_MANAGER_SUMMARY_ENABLED=True)
+    def test_managers_list_cursor_pagination(self):
+        rebuild_manager_summaries()
+        response = self.client.get(
+            reverse('user_manager_api:v1:managers-list'),
+            {'pagination': 'cursor', 'page_size': 1},
+        )
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(len(data['results']), 1)
+        response = self.client.get(data['next'])
+        data = json.loads(response.content)
+        self.assertEqual(data['results'][0]['email'], self.managers[1].email)
+        self.assertIsNone(data['next'])
+
+    def test_managers_list_cursor_pagination_without_summary(self):
+        response = self.client.get(reverse('user_manager_api:v1:managers-list'), {'pagination': 'cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    @ddt.data((False, ('',)), (True, ('', 'cursor')))
+    @ddt.unpack
+    def test_managers_list_report_count(self, summary_enabled, paginations):
+        with override_settings(USER_MANAGER_SUMMARY_ENABLED=summary_enabled):
+            rebuild_manager_summaries()
+            for pagination in paginations:
+                response = self.client.get(
+                    reverse('user_manager_api:v1:managers-list'),
+                    {'include': 'report_count', 'pagination': pagination},
+                )
+                data = json.loads(response.content)
+                self.assertEqual(
+                    [(manager['email'], manager['report_count']) for manager in data['results']],
+                    [(self.managers[0].email, 5), (self.managers[1].email, 6)],
+                )
+                self.assertNotIn('subtree_size', data['results'][0])
+
+    @override_settings(USER_MANAGER_HIERARCHY_ENABLED=True)
+    def test_managers_list_subtree_size(self):
+        rebuild_hierarchy()
+        UserManagerRole.objects.create(manager_user=self.managers[0], user=self.managers[1])
+        response = self.client.get(
+            reverse('user_manager_api:v1:managers-list'),
+            {'include': 'report_count,subtree_size'},
+        )
+        data = json.loads(response.content)
+        self.assertEqual(
+            [(manager['report_count'], manager['subtree_size']) for manager in data['results']],
+            [(6, 11), (6, 6)],
+        )
+
+    @ddt.data('unknown', 'subtree_size')
+    def test_managers_list_invalid_include(self, include):
+        response = self.client.get(reverse('user_manager_api:v1:managers-list'), {'include': include})
+        self.assertEqual(response.status_code, 400)
+
+    @ddt.data('manager-reports-list', 'user-managers-list')
+    def test_cursor_pagination_without_count(self, url_name):
+        url = reverse(
+            'user_manager_api:v1:{}'.format(url_name),
+            kwargs={'username': self.managers[1].email if url_name == 'manager-reports-list' else self.users[0].email},
+        )
+        response = self.client.get(url, {'pagination': 'cursor', 'count': 'false', 'page_size': 1})
+        data = json.loads(response.content)
+        self.assertNotIn('count', data)
+        results = data['results']
+        while data['next']:
+            data = json.loads(self.client.get(data['next']).content)
+            results.extend(data['results'])
+        expected = 6 if url_name == 'manager-reports-list' else 2
+        self.assertEqual(len(results), expected)
+        self.assertEqual(len(set(result['email'] for result in results)), expected)
+
     @ddt.data('username', 'email')
     def test_manager_reports_list_get(self, attr):
         url = reverse(
@@ -64,6 +145,33 @@ class UserManagerRoleViewsTest(TestCase):
         results = data['results']
         self.assertEqual(len(results), 5)
 
+    def test_manager_reports_list_get_subtree(self):
+        UserManagerRole.objects.create(manager_user=self.users[0], user=self.users[9])
+        # A cycle back to the root manager must not recurse forever.
+        UserManagerRole.objects.create(manager_user=self.users[9], user=self.managers[0])
+        url = reverse(
+            'user_manager_api:v1:manager-reports-list',
+            kwargs={'username': self.managers[0].username},
+        )
+        response = self.client.get(url, {'depth': 'all'})
+        data = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        depths = {result['email']: result['depth'] for result in data['results']}
+        expected = {user.email: 1 for user in self.users[:5]}
+        expected[self.users[9].email] = 2
+        self.assertEqual(depths, expected)
+
+        response = self.client.get(url, {'depth': 1})
+        data = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(len(data['results']), 5)
+
+    def test_manager_reports_list_get_subtree_invalid_depth(self):
+        url = reverse(
+            'user_manager_api:v1:manager-reports-list',
+            kwargs={'username': self.managers[0].username},
+        )
+        response = self.client.get(url, {'depth': 'none'})
+        self.assertEqual(response.status_code, 400)
+
     def test_manager_reports_list_post_duplicate(self):
         url = reverse(
             'user_manager_api:v1:manager-reports-list',
@@ -82,6 +190,48 @@ class UserManagerRoleViewsTest(TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertEqual(response.content, '{"detail":"No user with that email"}')
 
+    def test_manager_reports_list_post_bulk(self):
+        url = reverse(
+            'user_manager_api:v1:manager-reports-list',
+            kwargs={'username': self.managers[0].email},
+        )
+        emails = [self.users[0].email, self.users[5].email, 'non@existent.com', self.managers[0].email]
+        response = self.client.post(url, json.dumps({'emails': emails}), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.content)
+        self.assertEqual(
+            [result['status'] for result in data['results']],
+            ['existing', 'created', 'unknown', 'invalid'],
+        )
+        query = UserManagerRole.objects.filter(manager_user=self.managers[0])
+        self.assertEqual(query.count(), 6)
+
+    def test_manager_reports_list_post_bulk_email_case(self):
+        url = reverse(
+            'user_manager_api:v1:manager-reports-list',
+            kwargs={'username': self.managers[0].email},
+        )
+        emails = [self.users[5].email.upper(), self.users[6].email.title()]
+        response = self.client.post(url, json.dumps({'emails': emails}), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.content)
+        self.assertEqual(
+            [(result['email'], result['status']) for result in data['results']],
+            [(email, 'created') for email in emails],
+        )
+        self.assertEqual(UserManagerRole.objects.filter(manager_user=self.managers[0]).count(), 7)
+
+    def test_manager_reports_list_post_bulk_unregistered_manager(self):
+        url = reverse(
+            'user_manager_api:v1:manager-reports-list',
+            kwargs={'username': 'unregistered@user.com'},
+        )
+        emails = [user.email for user in self.users]
+        response = self.client.post(url, json.dumps({'emails': emails}), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        query = UserManagerRole.objects.filter(unregistered_manager_email='unregistered@user.com')
+        self.assertEqual(query.count(), 10)
+
     def test_manager_reports_list_delete_all(self):
         url = reverse(
             'user_manager_api:v1:manager-reports-list',
@@ -147,6 +297,21 @@ class UserManagerRoleViewsTest(TestCase):
             query.values_list('unregistered_manager_email', flat=True),
         )
 
+    def test_user_managers_list_post_unregistered_normalized(self):
+        url = reverse(
+            'user_manager_api:v1:user-managers-list',
+            kwargs={'username': self.users[0].email},
+        )
+        self.client.post(url, {'email': 'Unregistered@User.com'})
+        self.client.post(url, {'email': 'unregistered@USER.com'})
+        query = UserManagerRole.objects.filter(user=self.users[0], manager_user__isnull=True)
+        self.assertEqual(list(query.values_list('unregistered_manager_email', flat=True)), ['unregistered@user.com'])
+        response = self.client.get(reverse(
+            'user_manager_api:v1:manager-reports-list',
+            kwargs={'username': 'UNREGISTERED@user.com'},
+        ))
+        self.assertEqual(json.loads(response.content)['count'], 1)
+
     def test_user_managers_list_delete_all(self):
         url = reverse(
             'user_manager_api:v1:user-managers-list',
@@ -185,3 +350,204 @@ class UserManagerRoleViewsTest(TestCase):
         )
         query = UserManagerRole.objects.filter(user=self.users[0])
         self.assertEqual(query.count(), 2)
+
+    @ddt.data('csv', 'ndjson')
+    def test_export(self, export_format):
+        response = self.client.get(
+            reverse('user_manager_api:v1:user-managers-export'),
+            {'export_format': export_format},
+        )
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        rows = UserManagerRole.objects.count()
+        if export_format == 'csv':
+            self.assertEqual(lines[0], 'user_id,user_email,manager_id,manager_email,registered')
+            self.assertEqual(len(lines), rows + 1)
+        else:
+            self.assertEqual(len(lines), rows)
+            self.assertEqual(
+                set(json.loads(lines[0])),
+                {'user_id', 'user_email', 'manager_id', 'manager_email', 'registered'},
+            )
+
+    def test_export_unsupported_format(self):
+        response = self.client.get(
+            reverse('user_manager_api:v1:user-managers-export'),
+            {'export_format': 'xml'},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_lookup(self):
+        response = self.client.post(
+            reverse('user_manager_api:v1:user-managers-lookup'),
+            json.dumps({'users': [
+                self.users[0].username,
+                self.users[5].email,
+                self.users[1].id,
+                self.managers[0].username,
+                'nobody',
+                'nobody@somecorp.com',
+            ]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['results'], {
+            'ids': {
+                str(self.users[1].id): [{'email': self.managers[0].email, 'id': self.managers[0].id}],
+            },
+            'usernames': {
+                self.users[0].username: [
+                    {'email': self.managers[0].email, 'id': self.managers[0].id},
+                    {'email': self.managers[1].email, 'id': self.managers[1].id},
+                ],
+                self.managers[0].username: [],
+            },
+            'emails': {
+                self.users[5].email: [{'email': self.managers[1].email, 'id': self.managers[1].id}],
+            },
+        })
+        self.assertEqual(data['unknown'], ['nobody', 'nobody@somecorp.com'])
+
+    def test_lookup_id_and_numeric_username(self):
+        numeric = UserFactory(username=str(self.users[1].id))
+        UserManagerRole.objects.create(manager_user=self.managers[1], user=numeric)
+        response = self.client.post(
+            reverse('user_manager_api:v1:user-managers-lookup'),
+            json.dumps({'users': [self.users[1].id, numeric.username]}),
+            content_type='application/json',
+        )
+        data = json.loads(response.content)
+        self.assertEqual(
+            data['results']['ids'][numeric.username],
+            [{'email': self.managers[0].email, 'id': self.managers[0].id}],
+        )
+        self.assertEqual(
+            data['results']['usernames'][numeric.username],
+            [{'email': self.managers[1].email, 'id': self.managers[1].id}],
+        )
+
+    def test_lookup_too_many_users(self):
+        response = self.client.post(
+            reverse('user_manager_api:v1:user-managers-lookup'),
+            json.dumps({'users': list(range(1, MAX_LOOKUP_USERS + 2))}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @ddt.data([], [None], [''], 'report0')
+    def test_lookup_invalid(self, users):
+        response = self.client.post(
+            reverse('user_manager_api:v1:user-managers-lookup'),
+            json.dumps({'users': users}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_lookup_chunks(self):
+        # One query per chunk of users of each kind, then one per chunk of roles.
+        with self.assertNumQueries(6):
+            managers = get_managers_for_users(
+                usernames=[user.username for user in self.users[:2]],
+                emails=[user.email for user in self.users[2:4]],
+                user_ids=[self.users[4].id],
+                chunk_size=2,
+            )
+        self.assertEqual(len(managers), 5)
+        self.assertEqual(managers[('id', self.users[4].id)], [(self.managers[0].id, self.managers[0].email)])
+
+    def _get_query_count(self, url, page_size):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'pagination': 'cursor', 'page_size': page_size})
+        self.assertEqual(len(json.loads(response.content)['results']), page_size)
+        return len(queries)
+
+    @ddt.data('manager-reports-list', 'user-managers-list')
+    def test_list_query_count_independent_of_page_size(self, url_name):
+        User.objects.bulk_create([
+            User(username='bulk{}'.format(idx), email='bulk{}@somecorp.com'.format(idx))
+            for idx in range(1000)
+        ])
+        bulk_users = User.objects.filter(username__startswith='bulk')
+        if url_name == 'manager-reports-list':
+            username = self.managers[0].username
+            UserManagerRole.objects.bulk_create([
+                UserManagerRole(user=user, manager_user=self.managers[0]) for user in bulk_users
+            ])
+        else:
+            username = self.users[0].username
+            UserManagerRole.objects.bulk_create([
+                UserManagerRole(user=self.users[0], manager_user=user) for user in bulk_users
+            ])
+        url = reverse('user_manager_api:v1:{}'.format(url_name), kwargs={'username': username})
+        self.assertEqual(
+            self._get_query_count(url, 10),
+            self._get_query_count(url, 1000),
+        )
+
+    @override_settings(USER_MANAGER_METRICS_SINKS=['user_manager.instrumentation.MemorySink'])
+    def test_instrumentation(self):
+        MemorySink.clear()
+        url = reverse(
+            'user_manager_api:v1:manager-reports-list',
+            kwargs={'username': self.managers[0].username},
+        )
+        self.client.get(url)
+        [(name, values, tags)] = [record for record in MemorySink.records if record[0] == 'view']
+        self.assertEqual(name, 'view')
+        self.assertEqual(tags, {'view': 'ManagerReportsListView', 'method': 'GET', 'status': 200})
+        self.assertEqual(values['rows'], 5)
+        self.assertGreater(values['queries'], 0)
+        self.assertIn('db_time_ms', values)
+        self.assertIn('response_time_ms', values)
+
+    @override_settings(USER_MANAGER_STATSD_PREFIX='um')
+    def test_statsd_metric_types(self):
+        sink = StatsdSink()
+        self.addCleanup(sink.socket.close)
+        with mock.patch.object(sink, 'socket') as mock_socket:
+            sink.emit('view', {'queries': 3, 'response_time_ms': 1.5, 'rows': None}, {'status': 200})
+        packet = mock_socket.sendto.call_args[0][0].decode('utf-8')
+        self.assertEqual(packet.splitlines(), ['um.view.200.queries:3|c', 'um.view.200.response_time_ms:1.5|ms'])
+
+    @override_settings(USER_MANAGER_ETAGS_ENABLED=True)
+    @ddt.data(
+        ('managers-list', None),
+        ('manager-reports-list', 'manager0'),
+        ('user-managers-list', 'report0@somecorp.com'),
+    )
+    @ddt.unpack
+    def test_conditional_get(self, url_name, username):
+        kwargs = {'username': username} if username else {}
+        url = reverse('user_manager_api:v1:{}'.format(url_name), kwargs=kwargs)
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in queries if 'user_manager_usermanagerrole' in query['sql']])
+        self.assertEqual(response['ETag'], etag)
+
+        UserManagerRole.objects.create(manager_user=self.managers[0], user=self.users[9])
+        UserManagerRole.objects.create(manager_user=self.users[9], user=self.users[0])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(USER_MANAGER_ETAGS_ENABLED=True)
+    def test_conditional_get_managers_unchanged(self):
+        url = reverse('user_manager_api:v1:managers-list')
+        etag = self.client.get(url)['ETag']
+        counts_etag = self.client.get(url, {'include': 'report_count'})['ETag']
+
+        UserFactory()
+        self.client.delete('{}?user={}'.format(
+            reverse('user_manager_api:v1:manager-reports-list', kwargs={'username': self.managers[0].username}),
+            self.users[9].email,
+        ))
+        UserManagerRole.objects.create(manager_user=self.managers[0], user=self.users[9])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.get(url, {'include': 'report_count'}, HTTP_IF_NONE_MATCH=counts_etag)
+        self.assertEqual(response.status_code, 200)
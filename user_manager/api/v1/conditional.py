@@ -0,0 +1,48 @@
+"""
+Conditional GET support for User Manager Application
+"""
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from django.utils.http import http_date, parse_etags
+
+from ...cache import get_versions, is_versioning_enabled
+
+
+class ConditionalListMixin(object):
+    """
+    Tags list responses with an ``ETag`` and ``Last-Modified`` derived from
+    the version stamps returned by ``get_version_keys()``, and answers a
+    matching ``If-None-Match`` with a 304 without running the list query.
+
+    Only active when ``USER_MANAGER_ETAGS_ENABLED`` is set.
+    """
+
+    def get_version_keys(self):
+        """
+        Return the cache keys of the version stamps the response depends on,
+        or ``None`` if it can't be tagged.
+        """
+        return None
+
+    def get(self, request, *args, **kwargs):
+        keys = self.get_version_keys() if is_versioning_enabled() else None
+        if not keys:
+            return super(ConditionalListMixin, self).get(request, *args, **kwargs)
+
+        versions = get_versions(keys)
+        fingerprint = '{}|{}'.format(request.get_full_path(), ','.join(repr(version) for version in versions))
+        etag = '"{}"'.format(hashlib.md5(fingerprint.encode('utf-8')).hexdigest())
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super(ConditionalListMixin, self).get(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(max(versions))
+        return response
@@ -0,0 +1,63 @@
+"""
+Pagination for User Manager Application
+"""
+from __future__ import absolute_import, unicode_literals
+
+from collections import OrderedDict
+
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+CURSOR_PAGINATION = 'cursor'
+
+
+class UserManagerCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the view's ``cursor_ordering``.
+
+    Unlike page number pagination, fetching a page never needs an ``OFFSET``
+    so every page costs the same. The total ``count`` is still included for
+    compatibility, unless ``count=false`` is passed, in which case no
+    ``COUNT`` query is run at all.
+    """
+    ordering = ('pk',)
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    count_query_param = 'count'
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, 'cursor_ordering', self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # pylint: disable=attribute-defined-outside-init
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() not in ('false', '0'):
+            self.count = queryset.count()
+        return super(UserManagerCursorPagination, self).paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+
+class CursorPaginationMixin(object):
+    """
+    Switches a list view to ``UserManagerCursorPagination`` when requested
+    with ``pagination=cursor``, keeping the default pagination otherwise.
+    """
+    cursor_pagination_class = UserManagerCursorPagination
+    cursor_ordering = ('pk',)
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == CURSOR_PAGINATION:
+                self._paginator = self.cursor_pagination_class()  # pylint: disable=attribute-defined-outside-init
+            else:
+                return super(CursorPaginationMixin, self).paginator
+        return self._paginator
@@ -3,21 +3,43 @@ Serializers for User Manager Application
 """
 from __future__ import absolute_import, unicode_literals
 
+from collections import OrderedDict
+
 from rest_framework import fields, serializers
 
 from django.core.validators import EmailValidator
+from django.utils import six
 
 from ...utils import create_user_manager_role
 
+# The most users whose managers can be looked up in a single request.
+MAX_LOOKUP_USERS = 1000
+
 
 class ManagerListSerializer(serializers.Serializer):  # pylint: disable=abstract-method
-    """ Serializer for User manager """
+    """
+    Serializer for User manager
+
+    The aggregate fields in ``AGGREGATE_FIELDS`` are only included when named
+    in the ``include`` context value.
+    """
+
+    AGGREGATE_FIELDS = ('report_count', 'subtree_size')
 
     email = fields.SerializerMethodField(validators=(EmailValidator,))
     id = fields.SerializerMethodField()
+    report_count = fields.IntegerField(read_only=True)
+    subtree_size = fields.IntegerField(read_only=True, allow_null=True)
 
     class Meta(object):
-        fields = ('email', 'id')
+        fields = ('email', 'id', 'report_count', 'subtree_size')
+
+    def __init__(self, *args, **kwargs):
+        super(ManagerListSerializer, self).__init__(*args, **kwargs)
+        include = self.context.get('include', ())
+        for field_name in self.AGGREGATE_FIELDS:
+            if field_name not in include:
+                self.fields.pop(field_name)
 
     def get_email(self, obj):
         if obj["manager_user"] is not None:
@@ -42,11 +64,52 @@ class ManagerReportsSerializer(serializers.Serializer):  # pylint: disable=abstr
         return create_user_manager_role(user, manager_user, unregistered_manager_email)
 
 
+class BulkManagerReportsSerializer(serializers.Serializer):  # pylint: disable=abstract-method
+    """ Serializer for adding many reports to a manager at once """
+
+    emails = fields.ListField(child=fields.EmailField())
+
+    def validate_emails(self, value):
+        if not value:
+            raise serializers.ValidationError('At least one email is required.')
+        # Preserve the order of the request while dropping duplicates.
+        return list(OrderedDict.fromkeys(value))
+
+
+class UserIdentifierField(fields.Field):
+    """ A user id, or a username or email address """
+
+    default_error_messages = {
+        'invalid': 'Must be a user id, username or email address.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool) or not isinstance(data, (int, six.string_types)) or data == '':
+            self.fail('invalid')
+        return data
+
+    def to_representation(self, value):
+        return value
+
+
+class UserManagersLookupSerializer(serializers.Serializer):  # pylint: disable=abstract-method
+    """ Serializer for looking up the managers of many users at once """
+
+    users = fields.ListField(child=UserIdentifierField())
+
+    def validate_users(self, value):
+        if not value:
+            raise serializers.ValidationError('At least one user is required.')
+        if len(value) > MAX_LOOKUP_USERS:
+            raise serializers.ValidationError('At most {} users can be looked up at once.'.format(MAX_LOOKUP_USERS))
+        return list(OrderedDict.fromkeys(value))
+
+
 class UserManagerSerializer(serializers.Serializer):  # pylint: disable=abstract-method
     """ Serializer for User manager reports """
 
     email = fields.EmailField(source='manager_email')
-    id = fields.IntegerField(source='user_manager.id', required=False)
+    id = fields.IntegerField(source='manager_user_id', required=False)
 
     def create(self, validated_data):
         user = validated_data.get('user')
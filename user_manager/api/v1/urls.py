@@ -27,4 +27,16 @@ urlpatterns = [
         views.ManagerReportsListView.as_view(),
         name='manager-reports-list',
     ),
+    # Look up the managers of many users
+    url(
+        r'^lookup/$',
+        views.UserManagerLookupView.as_view(),
+        name='user-managers-lookup',
+    ),
+    # Stream all user-manager relationships
+    url(
+        r'^export/$',
+        views.UserManagerExportView.as_view(),
+        name='user-managers-export',
+    ),
 ]
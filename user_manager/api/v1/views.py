@@ -3,18 +3,52 @@ Views for User Manager Application
 """
 from __future__ import absolute_import, unicode_literals
 
+import json
+from collections import OrderedDict
+
 from rest_framework import status
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import ListAPIView, ListCreateAPIView
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db.models import Count, F, Q
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
 
 from openedx.core.lib.api.view_utils import view_auth_classes
 
-from ...models import UserManagerRole
-from .serializers import ManagerListSerializer, ManagerReportsSerializer, UserManagerSerializer
+from ...cache import (
+    ALL_MANAGERS_VERSION_KEY,
+    ALL_REPORTS_VERSION_KEY,
+    manager_email_version_key,
+    manager_version_key,
+    user_version_key,
+)
+from ...export import CONTENT_TYPES, CSV_FORMAT, iter_export_lines
+from ...hierarchy import get_max_subtree_depth, is_hierarchy_enabled, iter_subtree, subtree_size
+from ...instrumentation import InstrumentedViewMixin
+from ...models import ManagerSummary, UserManagerRole, normalize_email
+from ...summary import is_summary_enabled
+from ...utils import bulk_create_user_manager_roles, delete_user_manager_roles, get_managers_for_users
+from .conditional import ConditionalListMixin
+from .pagination import CURSOR_PAGINATION, CursorPaginationMixin
+from .serializers import (
+    BulkManagerReportsSerializer,
+    ManagerListSerializer,
+    ManagerReportsSerializer,
+    UserManagerSerializer,
+    UserManagersLookupSerializer,
+)
+
+REPORT_CREATED = 'created'
+REPORT_EXISTING = 'existing'
+REPORT_UNKNOWN = 'unknown'
+REPORT_INVALID = 'invalid'
+
+# The key of the results of the lookup endpoint for each kind of user identifier.
+LOOKUP_RESULT_KINDS = OrderedDict((('id', 'ids'), ('username', 'usernames'), ('email', 'emails')))
 
 
 def _filter_by_manager_id(queryset, manager_id):
@@ -30,9 +64,10 @@ def _filter_by_manager_id(queryset, manager_id):
     if manager_id is None:
         return queryset
     elif '@' in manager_id:
+        # A subquery rather than a join lets each branch use its own index.
         return queryset.filter(
-            Q(manager_user__email=manager_id) |
-            Q(unregistered_manager_email=manager_id),
+            Q(manager_user_id__in=User.objects.filter(email=manager_id).values('id')) |
+            Q(manager_user__isnull=True, unregistered_manager_email=normalize_email(manager_id)),
         )
     else:
         return queryset.filter(
@@ -53,13 +88,84 @@ def _filter_by_user_id(queryset, user_id):
     if user_id is None:
         return queryset
     elif '@' in user_id:
-        return queryset.filter(user__email=user_id)
+        return queryset.filter(user_id__in=User.objects.filter(email=user_id).values('id'))
     else:
         return queryset.filter(user__username=user_id)
 
 
+def _get_manager(manager_id):
+    """
+    Resolves ``manager_id`` to a manager user account, falling back to the
+    unregistered manager email if ``manager_id`` is an email address without
+    an account.
+    Args:
+        manager_id(str): username or email address of manager
+    Returns:
+        a tuple of ``(manager_user, unregistered_manager_email)`` where
+        exactly one of the values is set
+    Raises:
+        User.DoesNotExist: if ``manager_id`` is an unknown username
+    """
+    if '@' in manager_id:
+        try:
+            return User.objects.get(email=manager_id), None
+        except User.DoesNotExist:
+            return None, manager_id
+    return User.objects.get(username=manager_id), None
+
+
+def _parse_depth(depth):
+    """
+    Parses the ``depth`` query parameter of a subtree request.
+    Args:
+        depth(str): ``all`` or a positive number of levels
+    Returns:
+        the number of levels to fetch, capped to the maximum subtree depth
+    """
+    max_depth = get_max_subtree_depth()
+    if depth == 'all':
+        return max_depth
+    try:
+        depth = int(depth)
+    except ValueError:
+        depth = 0
+    if depth < 1:
+        raise ValidationError({'depth': 'Must be "all" or a positive integer.'})
+    return min(depth, max_depth)
+
+
+def _parse_include(include):
+    """
+    Parses the ``include`` query parameter of the managers list.
+    Args:
+        include(str): comma separated names of aggregate fields
+    Returns:
+        the set of aggregate fields to include
+    """
+    fields = set(field for field in include.split(',') if field)
+    unknown = fields - set(ManagerListSerializer.AGGREGATE_FIELDS)
+    if unknown:
+        raise ValidationError({'include': 'Unknown fields: {}.'.format(', '.join(sorted(unknown)))})
+    if 'subtree_size' in fields and not is_hierarchy_enabled():
+        raise ValidationError({'include': 'subtree_size requires USER_MANAGER_HIERARCHY_ENABLED.'})
+    return fields
+
+
+def _iter_subtree_json(rows):
+    """
+    Yields a JSON document with a ``results`` list built from subtree ``rows``,
+    one report at a time.
+    """
+    yield '{"results": ['
+    separator = ''
+    for user_id, email, depth in rows:
+        yield separator + json.dumps({'email': email, 'id': user_id, 'depth': depth})
+        separator = ', '
+    yield ']}'
+
+
 @view_auth_classes(is_authenticated=True)
-class ManagerListView(ListAPIView):
+class ManagerListView(InstrumentedViewMixin, ConditionalListMixin, CursorPaginationMixin, ListAPIView):
     """
         **Use Case**
 
@@ -69,9 +175,32 @@ class ManagerListView(ListAPIView):
 
             GET /api/user_manager/v1/managers/
 
+            GET /api/user_manager/v1/managers/?pagination=cursor&count=false
+
+            GET /api/user_manager/v1/managers/?include=report_count,subtree_size
+
         **GET Parameters**
 
-            None
+            * include: Comma separated aggregate fields to add to each manager,
+                ``report_count`` and ``subtree_size``. ``subtree_size`` requires
+                ``USER_MANAGER_HIERARCHY_ENABLED``.
+
+            * pagination: Set to ``cursor`` to use keyset pagination, where ``next``
+                and ``previous`` are cursor links and no page numbers are returned.
+                Requires ``USER_MANAGER_SUMMARY_ENABLED``, which provides the
+                indexed, unique key the cursor pages on.
+
+            * count: With cursor pagination, set to ``false`` to omit ``count``
+                and skip counting all results.
+
+            * page_size: With cursor pagination, the number of results per page.
+
+        **Conditional Requests**
+
+            When ``USER_MANAGER_ETAGS_ENABLED`` is set, responses have ``ETag`` and
+            ``Last-Modified`` headers, and a request with a matching ``If-None-Match``
+            header gets an empty HTTP 304 "Not Modified" response. This also applies
+            to the per-user list views, except when fetching indirect reports.
 
         **GET Response Values**
 
@@ -95,6 +224,11 @@ class ManagerListView(ListAPIView):
 
                 * email: Email address of manager.
 
+                * report_count: The number of direct reports of the manager, if included.
+
+                * subtree_size: The number of direct and indirect reports of the manager,
+                    or null if manager doesn't have an account yet, if included.
+
         **Example GET Response**
 
             {
@@ -111,15 +245,57 @@ class ManagerListView(ListAPIView):
             }
     """
     serializer_class = ManagerListSerializer
-    queryset = UserManagerRole.objects.values(
-        'manager_user',
-        'manager_user__email',
-        'unregistered_manager_email',
-    ).distinct()
+    cursor_ordering = ('id',)
+
+    @property
+    def paginator(self):
+        # Without the summary table, managers are grouped from their roles and
+        # have no indexed, unique key to page on.
+        if self.request.query_params.get('pagination') == CURSOR_PAGINATION and not is_summary_enabled():
+            raise ValidationError({'pagination': 'cursor requires USER_MANAGER_SUMMARY_ENABLED.'})
+        return super(ManagerListView, self).paginator
+
+    def get_include(self):
+        return _parse_include(self.request.query_params.get('include', ''))
+
+    def get_queryset(self):
+        if is_summary_enabled():
+            queryset = ManagerSummary.objects.values(
+                'id',
+                'manager_user',
+                'manager_user__email',
+                'unregistered_manager_email',
+                'report_count',
+            )
+        else:
+            queryset = UserManagerRole.objects.values(
+                'manager_user',
+                'manager_user__email',
+                'unregistered_manager_email',
+            ).annotate(
+                manager_email=Coalesce(F('manager_user__email'), F('unregistered_manager_email')),
+                report_count=Count('id'),
+            ).order_by('manager_email')
+        if 'subtree_size' in self.get_include():
+            queryset = queryset.annotate(subtree_size=subtree_size('manager_user'))
+        return queryset
+
+    def get_serializer_context(self):
+        context = super(ManagerListView, self).get_serializer_context()
+        context['include'] = self.get_include()
+        return context
+
+    def get_version_keys(self):
+        # Report counts and subtree sizes change with any report.
+        if self.get_include():
+            return [ALL_MANAGERS_VERSION_KEY, ALL_REPORTS_VERSION_KEY]
+        return [ALL_MANAGERS_VERSION_KEY]
 
 
 @view_auth_classes(is_authenticated=True)
-class ManagerReportsListView(ListCreateAPIView):
+class ManagerReportsListView(
+        InstrumentedViewMixin, ConditionalListMixin, CursorPaginationMixin, ListCreateAPIView,
+):
     """
         **Use Case**
 
@@ -133,10 +309,16 @@ class ManagerReportsListView(ListCreateAPIView):
 
             GET /api/user_manager/v1/reports/{user_id}/
 
+            GET /api/user_manager/v1/reports/{user_id}/?depth=all
+
             POST /api/user_manager/v1/reports/{user_id}/ {
                 "email": "{email}"
             }
 
+            POST /api/user_manager/v1/reports/{user_id}/ {
+                "emails": ["{email}", ...]
+            }
+
             DELETE /api/user_manager/v1/reports/{user_id}/
 
             DELETE /api/user_manager/v1/reports/{user_id}/?user={user_id}
@@ -145,12 +327,20 @@ class ManagerReportsListView(ListCreateAPIView):
 
             * user_id: username or email address for user whose reports you want fetch
 
+            * depth: ``all`` or a number of levels, to fetch indirect reports as well.
+                The response is then streamed with all results and is not paginated.
+
+            * pagination, count, page_size: See ``ManagerListView``.
+
         **POST Parameters**
 
             * user_id: username or email address for user for whom you want to add a manger
 
             * email: Email address for a user
 
+            * emails: List of email addresses for users, to add many reports at once.
+                Used instead of ``email``.
+
         **DELETE Parameters**
 
             * user_id: username or email address for user
@@ -193,6 +383,16 @@ class ManagerReportsListView(ListCreateAPIView):
                 }
             }
 
+            GET /api/user_manager/v1/reports/edx@example.com/?depth=all
+
+            {
+                "results": [
+                    {"email": "staff@example.com", "id": 9, "depth": 1},
+                    {"email": "learner@example.com", "id": 15, "depth": 2},
+                    { ... }
+                ]
+            }
+
         **Example POST Response**
 
             POST /api/user_manager/v1/reports/edx@example.com/ {
@@ -204,6 +404,27 @@ class ManagerReportsListView(ListCreateAPIView):
                 "id": 11
             }
 
+            POST /api/user_manager/v1/reports/edx@example.com/ {
+                "emails": ["user@email.com", "other@email.com", "nobody@email.com"]
+            }
+
+            {
+                "results": [
+                    {"email": "user@email.com", "status": "existing"},
+                    {"email": "other@email.com", "status": "created"},
+                    {"email": "nobody@email.com", "status": "unknown"}
+                ]
+            }
+
+            The status of each email is one of ``created``, ``existing``,
+            ``unknown`` (no user with that email) or ``invalid`` (the user
+            is the manager). Emails are matched to users regardless of case.
+            The response is a 201 if any report was created, and a 200 otherwise.
+
+            On Django 2.2 and later, a report added by a concurrent request
+            between the check for existing reports and the insert is skipped
+            by the insert, but still reported as ``created``.
+
         **Example DELETE Response**
 
             DELETE /api/user_manager/v1/reports/edx@exmaple.com/
@@ -213,12 +434,103 @@ class ManagerReportsListView(ListCreateAPIView):
     """
     serializer_class = ManagerReportsSerializer
 
-    def get_queryset(self):
+    def get_role_queryset(self):
         username = self.kwargs['username']
         return _filter_by_manager_id(UserManagerRole.objects, username)
 
-    def perform_create(self, serializer):
+    def get_version_keys(self):
+        if 'depth' in self.request.query_params:
+            # Indirect reports depend on too many version stamps.
+            return None
         manager_id = self.kwargs['username']
+        if '@' in manager_id:
+            manager_ids = User.objects.filter(email=manager_id).values_list('id', flat=True)
+            return [manager_email_version_key(manager_id)] + [manager_version_key(pk) for pk in manager_ids]
+        manager_ids = User.objects.filter(username=manager_id).values_list('id', flat=True)
+        return [manager_version_key(pk) for pk in manager_ids]
+
+    def get_queryset(self):
+        # Fetch the serialized user columns in the same query, in the order of
+        # the (manager_user, user) index.
+        return self.get_role_queryset().select_related('user').only(
+            'user',
+            'user__email',
+        ).order_by('user_id', 'id')
+
+    def list(self, request, *args, **kwargs):
+        depth = request.query_params.get('depth')
+        if depth is None:
+            return super(ManagerReportsListView, self).list(request, *args, **kwargs)
+        return self.list_subtree(_parse_depth(depth))
+
+    def list_subtree(self, depth):
+        """
+        Stream all direct and indirect reports of the manager up to ``depth``
+        levels deep, resolved in a single query.
+        """
+        try:
+            manager_user, _ = _get_manager(self.kwargs['username'])
+        except User.DoesNotExist:
+            manager_user = None
+        rows = iter_subtree(
+            self.get_role_queryset(),
+            max_depth=depth,
+            exclude_user_id=manager_user.pk if manager_user else None,
+        )
+        return StreamingHttpResponse(_iter_subtree_json(rows), content_type='application/json')
+
+    def create(self, request, *args, **kwargs):
+        if 'emails' in request.data:
+            return self.bulk_create(request)
+        return super(ManagerReportsListView, self).create(request, *args, **kwargs)
+
+    def bulk_create(self, request):
+        """
+        Add all users in the ``emails`` list as reports of the manager, using
+        a fixed number of queries regardless of the number of emails.
+        """
+        serializer = BulkManagerReportsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        emails = serializer.validated_data['emails']
+
+        try:
+            manager_user, manager_email = _get_manager(self.kwargs['username'])
+        except User.DoesNotExist:
+            raise NotFound(detail='No manager with that username')
+
+        # Case-insensitive collations match emails in any case, so match the
+        # stored emails back to the requested ones after normalizing both.
+        users = User.objects.filter(
+            email__in=set(emails) | set(normalize_email(email) for email in emails),
+        ).only('id', 'email')
+        users_by_email = {}
+        for user in users:
+            users_by_email.setdefault(normalize_email(user.email), user)
+        created_ids, existing_ids = bulk_create_user_manager_roles(
+            users_by_email.values(),
+            manager_user=manager_user,
+            manager_email=manager_email,
+        )
+
+        results = []
+        for email in emails:
+            user = users_by_email.get(normalize_email(email))
+            if user is None:
+                report_status = REPORT_UNKNOWN
+            elif user.pk in created_ids:
+                report_status = REPORT_CREATED
+            elif user.pk in existing_ids:
+                report_status = REPORT_EXISTING
+            else:
+                report_status = REPORT_INVALID
+            results.append({'email': email, 'status': report_status})
+
+        return Response(
+            {'results': results},
+            status=status.HTTP_201_CREATED if created_ids else status.HTTP_200_OK,
+        )
+
+    def perform_create(self, serializer):
         email = serializer.validated_data.get('user', {}).get('email')
 
         try:
@@ -226,26 +538,23 @@ class ManagerReportsListView(ListCreateAPIView):
         except User.DoesNotExist:
             raise NotFound(detail='No user with that email')
 
-        if '@' in manager_id:
-            try:
-                manager_user = User.objects.get(email=manager_id)
-            except User.DoesNotExist:
-                serializer.save(user=user, unregistered_manager_email=manager_id)
-                return
+        manager_user, manager_email = _get_manager(self.kwargs['username'])
+        if manager_user is None:
+            serializer.save(user=user, unregistered_manager_email=manager_email)
         else:
-            manager_user = User.objects.get(username=manager_id)
-
-        serializer.save(manager_user=manager_user, user=user)
+            serializer.save(manager_user=manager_user, user=user)
 
     def delete(self, request, *args, **kwargs):  # pylint: disable=unused-argument
         user = request.query_params.get('user')
-        queryset = _filter_by_user_id(self.get_queryset(), user)
-        queryset.delete()
+        queryset = _filter_by_user_id(self.get_role_queryset(), user)
+        delete_user_manager_roles(queryset)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 @view_auth_classes(is_authenticated=True)
-class UserManagerListView(ListCreateAPIView):
+class UserManagerListView(
+        InstrumentedViewMixin, ConditionalListMixin, CursorPaginationMixin, ListCreateAPIView,
+):
     """
         **Use Case**
 
@@ -271,6 +580,8 @@ class UserManagerListView(ListCreateAPIView):
 
             * user_id: username or email address for user whose managers you want fetch
 
+            * pagination, count, page_size: See ``ManagerListView``.
+
         **POST Parameters**
 
             * user_id: username or email address for user for whom you want to add a manger
@@ -346,10 +657,24 @@ class UserManagerListView(ListCreateAPIView):
         else:
             return User.objects.get(username=userid)
 
-    def get_queryset(self):
+    def get_role_queryset(self):
         username = self.kwargs['username']
         return _filter_by_user_id(UserManagerRole.objects, username)
 
+    def get_version_keys(self):
+        username = self.kwargs['username']
+        lookup = {'email': username} if '@' in username else {'username': username}
+        return [user_version_key(pk) for pk in User.objects.filter(**lookup).values_list('id', flat=True)]
+
+    def get_queryset(self):
+        # Fetch the serialized manager columns in the same query, in the order
+        # of the (user, manager_user) index.
+        return self.get_role_queryset().select_related('manager_user').only(
+            'manager_user',
+            'manager_user__email',
+            'unregistered_manager_email',
+        ).order_by('manager_user_id', 'id')
+
     def perform_create(self, serializer):
         try:
             user = self._get_user_by_username_or_email(self.kwargs['username'])
@@ -366,6 +691,151 @@ class UserManagerListView(ListCreateAPIView):
 
     def delete(self, request, *args, **kwargs):  # pylint: disable=unused-argument
         manager = request.query_params.get('manager')
-        queryset = _filter_by_manager_id(self.get_queryset(), manager)
-        queryset.delete()
+        queryset = _filter_by_manager_id(self.get_role_queryset(), manager)
+        delete_user_manager_roles(queryset)
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@view_auth_classes(is_authenticated=True)
+class UserManagerLookupView(InstrumentedViewMixin, APIView):
+    """
+        **Use Case**
+
+            * Get the managers of many users in a single request.
+
+        **Example Request**
+
+            POST /api/user_manager/v1/lookup/ {
+                "users": ["user", "other@email.com", 12]
+            }
+
+        **POST Parameters**
+
+            * users: A list of at most 1000 users, each given as a user id (a JSON
+                number), an email address or a username.
+
+        **POST Response Values**
+
+            If the request is valid, an HTTP 200 "OK" response is returned with the
+            following values.
+
+            * results: An object with ``ids``, ``usernames`` and ``emails`` objects,
+                for the users given by each kind of value. Each has a key for each
+                user that was found, with the value given in ``users``, so the
+                user id ``12`` and the username ``"12"`` are kept apart. Each value
+                is a list of managers:
+
+                * id: The user id for a manager user, or null if manager doesn't have an
+                    account yet.
+
+                * email: Email address of manager.
+
+            * unknown: The values in ``users`` that don't match any user.
+
+        **Example POST Response**
+
+            {
+                "results": {
+                    "ids": {
+                        "12": []
+                    },
+                    "usernames": {
+                        "user": [
+                            {
+                                "email": "staff@example.com",
+                                "id": 9
+                            }
+                        ]
+                    },
+                    "emails": {}
+                },
+                "unknown": ["other@email.com"]
+            }
+    """
+
+    def post(self, request, *args, **kwargs):  # pylint: disable=unused-argument
+        serializer = UserManagersLookupSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        identifiers = serializer.validated_data['users']
+
+        keys = []
+        for identifier in identifiers:
+            if isinstance(identifier, int):
+                keys.append(('id', identifier))
+            elif '@' in identifier:
+                keys.append(('email', identifier))
+            else:
+                keys.append(('username', identifier))
+        managers = get_managers_for_users(
+            usernames=[value for field, value in keys if field == 'username'],
+            emails=[value for field, value in keys if field == 'email'],
+            user_ids=[value for field, value in keys if field == 'id'],
+        )
+
+        results = OrderedDict((kind, OrderedDict()) for kind in LOOKUP_RESULT_KINDS.values())
+        unknown = []
+        for key in keys:
+            if key in managers:
+                results[LOOKUP_RESULT_KINDS[key[0]]][key[1]] = [
+                    {'email': manager_email, 'id': manager_user_id}
+                    for manager_user_id, manager_email in managers[key]
+                ]
+            else:
+                unknown.append(key[1])
+        return Response({'results': results, 'unknown': unknown})
+
+
+@view_auth_classes(is_authenticated=True)
+class UserManagerExportView(InstrumentedViewMixin, APIView):
+    """
+        **Use Case**
+
+            * Export every user-manager relationship in a single streamed response.
+
+        **Example Request**
+
+            GET /api/user_manager/v1/export/
+
+            GET /api/user_manager/v1/export/?export_format=ndjson
+
+        **GET Parameters**
+
+            * export_format: ``csv`` (default) or ``ndjson``.
+
+        **GET Response Values**
+
+            A streamed ``text/csv`` or ``application/x-ndjson`` response with one
+            row per relationship, with the following values:
+
+            * user_id: The user id of the report.
+
+            * user_email: Email address of the report.
+
+            * manager_id: The user id of the manager, or empty if the manager doesn't
+                have an account yet.
+
+            * manager_email: Email address of the manager.
+
+            * registered: Whether the manager has an account.
+
+        **Example GET Response**
+
+            GET /api/user_manager/v1/export/?export_format=ndjson
+
+            {"user_id": 11, "user_email": "user@email.com", "manager_id": 9, ...}
+            {"user_id": 12, "user_email": "other@email.com", "manager_id": null, ...}
+    """
+
+    def get(self, request, *args, **kwargs):  # pylint: disable=unused-argument
+        export_format = request.query_params.get('export_format', CSV_FORMAT)
+        if export_format not in CONTENT_TYPES:
+            return Response(
+                {'detail': 'Unsupported export format.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        response = StreamingHttpResponse(
+            iter_export_lines(export_format),
+            content_type=CONTENT_TYPES[export_format],
+        )
+        response['Content-Disposition'] = 'attachment; filename="user_managers.{}"'.format(export_format)
+        return response
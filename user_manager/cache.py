@@ -0,0 +1,187 @@
+"""
+Caching of manager relationships for User Manager Application.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import UserManagerRole, normalize_email
+
+MANAGERS_CACHE_KEY = 'user_manager.managers.{user_id}'
+VERSION_CACHE_KEY = 'user_manager.version.{scope}.{key}'
+ALL_MANAGERS_VERSION_KEY = VERSION_CACHE_KEY.format(scope='all', key='managers')
+ALL_REPORTS_VERSION_KEY = VERSION_CACHE_KEY.format(scope='all', key='reports')
+
+
+def get_cache_timeout():
+    """
+    Return how long the managers of a user are cached for, in seconds.
+
+    Caching is disabled by default. Enable it by setting
+    ``USER_MANAGER_ROLE_CACHE_TIMEOUT`` to a positive number of seconds.
+    """
+    return getattr(settings, 'USER_MANAGER_ROLE_CACHE_TIMEOUT', 0)
+
+
+def is_cache_enabled():
+    """
+    Return whether the managers of a user are cached.
+    """
+    return get_cache_timeout() != 0
+
+
+class _DeleteKeys(object):
+    """
+    ``on_commit`` callback dropping cache ``keys``.
+
+    Until it runs, it also marks the keys as written by the current
+    transaction.
+    """
+
+    def __init__(self, keys):
+        self.keys = frozenset(keys)
+
+    def __call__(self):
+        cache.delete_many(list(self.keys))
+
+
+def _has_pending_writes(key):
+    """
+    Return whether the current transaction changed the managers cached at
+    ``key`` without committing yet.
+
+    Django drops the ``on_commit`` callbacks of rolled back transactions and
+    savepoints, so only uncommitted writes are found.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return False
+    return any(
+        isinstance(entry[1], _DeleteKeys) and key in entry[1].keys
+        for entry in connection.run_on_commit
+    )
+
+
+def get_managers(user_id):
+    """
+    Return the managers of the user with ``user_id``.
+
+    Returns a tuple of the ids of registered managers and the emails of
+    unregistered managers, each as a ``frozenset``. The result is read
+    from, and stored in, Django's cache when caching is enabled. Managers
+    read while the current transaction has uncommitted changes to them are
+    not stored, as the transaction may still be rolled back.
+    """
+    key = MANAGERS_CACHE_KEY.format(user_id=user_id)
+    managers = cache.get(key) if is_cache_enabled() else None
+    if managers is None:
+        rows = list(UserManagerRole.objects.filter(user_id=user_id).values_list(
+            'manager_user_id',
+            'unregistered_manager_email',
+        ))
+        manager_ids = frozenset(manager_id for manager_id, _ in rows if manager_id is not None)
+        manager_emails = frozenset(email for manager_id, email in rows if manager_id is None)
+        managers = (manager_ids, manager_emails)
+        if is_cache_enabled() and not _has_pending_writes(key):
+            cache.set(key, managers, get_cache_timeout())
+    return managers
+
+
+def invalidate_managers(user_ids):
+    """
+    Drop the cached managers of all ``user_ids``.
+
+    The keys are dropped again once the current transaction commits, so a
+    concurrent request can't leave stale data behind from before the commit.
+    Until then, the managers of ``user_ids`` are not cached again.
+    """
+    if not is_cache_enabled():
+        return
+    keys = [MANAGERS_CACHE_KEY.format(user_id=user_id) for user_id in set(user_ids)]
+    if keys:
+        cache.delete_many(keys)
+        transaction.on_commit(_DeleteKeys(keys))
+
+
+def is_versioning_enabled():
+    """
+    Return whether version stamps of manager relationships are kept, to
+    support conditional requests on the list views.
+
+    Enable with ``USER_MANAGER_ETAGS_ENABLED``. This needs a cache shared by
+    all processes, otherwise a process may answer with an outdated stamp.
+    """
+    return getattr(settings, 'USER_MANAGER_ETAGS_ENABLED', False)
+
+
+def _email_key(email):
+    return hashlib.md5(normalize_email(email).encode('utf-8')).hexdigest()
+
+
+def user_version_key(user_id):
+    """
+    Return the cache key of the version stamp of the managers of a user.
+    """
+    return VERSION_CACHE_KEY.format(scope='user', key=user_id)
+
+
+def manager_version_key(manager_id):
+    """
+    Return the cache key of the version stamp of the reports of a registered manager.
+    """
+    return VERSION_CACHE_KEY.format(scope='manager', key=manager_id)
+
+
+def manager_email_version_key(email):
+    """
+    Return the cache key of the version stamp of the reports of a manager email.
+    """
+    return VERSION_CACHE_KEY.format(scope='email', key=_email_key(email))
+
+
+def bump_versions(user_ids=(), manager_ids=(), manager_emails=(), managers_changed=True):
+    """
+    Give new version stamps to the managers of ``user_ids``, the reports of
+    ``manager_ids`` and ``manager_emails``, and all reports. The list of all
+    managers only gets a new stamp if ``managers_changed``, i.e. a manager
+    was added to or removed from it.
+
+    The stamps are bumped right away, and again once the transaction
+    commits so a response built from data read before the commit is not
+    tagged with the new stamp.
+    """
+    if not is_versioning_enabled():
+        return
+    keys = [ALL_REPORTS_VERSION_KEY]
+    if managers_changed:
+        keys.append(ALL_MANAGERS_VERSION_KEY)
+    keys.extend(user_version_key(user_id) for user_id in set(user_ids))
+    keys.extend(manager_version_key(manager_id) for manager_id in set(manager_ids) if manager_id is not None)
+    keys.extend(manager_email_version_key(email) for email in set(manager_emails) if email)
+
+    def bump():
+        cache.set_many(dict.fromkeys(keys, time.time()), None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def get_versions(keys):
+    """
+    Return the version stamps of ``keys``, as timestamps.
+
+    Keys without a stamp, e.g. because they were evicted, get a new one.
+    """
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        now = time.time()
+        for key in missing:
+            cache.add(key, now, None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key, time.time()) for key in keys]
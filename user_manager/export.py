@@ -0,0 +1,107 @@
+"""
+Export of the complete user-manager relationship graph for User Manager Application.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import csv
+import json
+
+from django.utils import six
+
+from .models import UserManagerRole
+
+EXPORT_FIELDS = ('user_id', 'user_email', 'manager_id', 'manager_email', 'registered')
+EXPORT_CHUNK_SIZE = 2000
+
+CSV_FORMAT = 'csv'
+NDJSON_FORMAT = 'ndjson'
+CONTENT_TYPES = {
+    CSV_FORMAT: 'text/csv',
+    NDJSON_FORMAT: 'application/x-ndjson',
+}
+
+
+class _Echo(object):
+    """
+    File-like object that returns written values instead of buffering them,
+    so ``csv.writer`` can be used to produce a stream of lines.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_user_manager_roles(chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield a dict with ``EXPORT_FIELDS`` for every ``UserManagerRole``.
+
+    Rows are fetched in chunks of ``chunk_size`` ordered by primary key,
+    resuming after the last key seen, so memory use stays flat and each
+    chunk is an indexed range scan regardless of the size of the table.
+    """
+    queryset = UserManagerRole.objects.order_by('pk').values_list(
+        'pk',
+        'user_id',
+        'user__email',
+        'manager_user_id',
+        'manager_user__email',
+        'unregistered_manager_email',
+    )
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+        for _, user_id, user_email, manager_id, manager_email, unregistered_email in chunk:
+            yield {
+                'user_id': user_id,
+                'user_email': user_email,
+                'manager_id': manager_id,
+                'manager_email': manager_email if manager_id is not None else unregistered_email,
+                'registered': manager_id is not None,
+            }
+        last_pk = chunk[-1][0]
+
+
+def _write_csv_row(writer, row):
+    """
+    Return the CSV line of ``row`` as text.
+
+    The Python 2 ``csv`` module only handles byte strings, so values are
+    encoded before writing and the line is decoded afterwards.
+    """
+    if six.PY2:
+        row = {
+            key: value.encode('utf-8') if isinstance(value, six.text_type) else value
+            for key, value in row.items()
+        }
+        return writer.writerow(row).decode('utf-8')
+    return writer.writerow(row)
+
+
+def iter_csv_lines(rows):
+    """
+    Yield a header line followed by a CSV line for each row in ``rows``.
+    """
+    writer = csv.DictWriter(_Echo(), fieldnames=EXPORT_FIELDS)
+    yield _write_csv_row(writer, dict(zip(EXPORT_FIELDS, EXPORT_FIELDS)))
+    for row in rows:
+        yield _write_csv_row(writer, row)
+
+
+def iter_ndjson_lines(rows):
+    """
+    Yield a JSON document on its own line for each row in ``rows``.
+    """
+    for row in rows:
+        yield six.text_type(json.dumps(row)) + '\n'
+
+
+def iter_export_lines(export_format=CSV_FORMAT, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the lines of a full export of the relationship graph in ``export_format``.
+    """
+    rows = iter_user_manager_roles(chunk_size=chunk_size)
+    if export_format == NDJSON_FORMAT:
+        return iter_ndjson_lines(rows)
+    return iter_csv_lines(rows)
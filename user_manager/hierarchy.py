@@ -0,0 +1,228 @@
+"""
+Queries over the whole reporting hierarchy for User Manager Application.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+
+from .models import UserManagerHierarchy, UserManagerRole
+
+SUBTREE_FETCH_SIZE = 2000
+HIERARCHY_CHUNK_SIZE = 500
+
+
+def get_max_subtree_depth():
+    """
+    Return the deepest level of indirect reports that will be resolved.
+
+    This also bounds the recursion when the reporting graph contains a cycle.
+    """
+    return getattr(settings, 'USER_MANAGER_MAX_SUBTREE_DEPTH', 100)
+
+
+def is_hierarchy_enabled():
+    """
+    Return whether the ``UserManagerHierarchy`` closure table is maintained.
+    """
+    return getattr(settings, 'USER_MANAGER_HIERARCHY_ENABLED', False)
+
+
+def _chunks(items, chunk_size):
+    items = list(items)
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def _insert_ancestors(user_ids):
+    """
+    Insert closure rows for every ancestor of each of ``user_ids``.
+
+    The ancestors are walked up from the role table with a single recursive
+    CTE, bounded by ``get_max_subtree_depth()`` in case of cycles.
+    """
+    quote = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    sql = '''
+        INSERT INTO {hierarchy_table} (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE ancestors (descendant_id, ancestor_id, depth) AS (
+            SELECT user_id, manager_user_id, 1
+            FROM {role_table}
+            WHERE manager_user_id IS NOT NULL AND user_id IN ({placeholders})
+            UNION
+            SELECT ancestors.descendant_id, report_role.manager_user_id, ancestors.depth + 1
+            FROM {role_table} report_role
+            INNER JOIN ancestors ON report_role.user_id = ancestors.ancestor_id
+            WHERE report_role.manager_user_id IS NOT NULL AND ancestors.depth < %s
+        )
+        SELECT ancestor_id, descendant_id, MIN(depth)
+        FROM ancestors
+        WHERE ancestor_id <> descendant_id
+        GROUP BY ancestor_id, descendant_id
+    '''.format(
+        hierarchy_table=quote(UserManagerHierarchy._meta.db_table),
+        role_table=quote(UserManagerRole._meta.db_table),
+        placeholders=placeholders,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(user_ids) + [get_max_subtree_depth()])
+
+
+def refresh_hierarchy(user_ids):
+    """
+    Bring the closure table up to date after the managers of ``user_ids`` changed.
+
+    Only the closure rows of the changed users and of everyone reporting to
+    them are rebuilt, inside the current transaction. Does nothing unless
+    ``is_hierarchy_enabled()``.
+    """
+    if not is_hierarchy_enabled():
+        return
+    affected = set(user_ids)
+    if not affected:
+        return
+    with transaction.atomic():
+        for chunk in _chunks(sorted(affected), HIERARCHY_CHUNK_SIZE):
+            affected.update(
+                UserManagerHierarchy.objects.filter(
+                    ancestor_id__in=chunk,
+                ).values_list('descendant_id', flat=True)
+            )
+        for chunk in _chunks(sorted(affected), HIERARCHY_CHUNK_SIZE):
+            UserManagerHierarchy.objects.filter(descendant_id__in=chunk).delete()
+            _insert_ancestors(chunk)
+
+
+def rebuild_hierarchy(chunk_size=HIERARCHY_CHUNK_SIZE, progress=None):
+    """
+    Rebuild the whole closure table from the role table.
+
+    Users are processed in chunks of ``chunk_size``, each in its own
+    transaction. ``progress`` is called with the number of users processed
+    so far after each chunk. Returns the number of users processed.
+    """
+    UserManagerHierarchy.objects.all().delete()
+    user_ids = UserManagerRole.objects.filter(
+        manager_user__isnull=False,
+    ).order_by('user_id').values_list('user_id', flat=True).distinct()
+    processed = 0
+    last_user_id = 0
+    while True:
+        chunk = list(user_ids.filter(user_id__gt=last_user_id)[:chunk_size])
+        if not chunk:
+            return processed
+        with transaction.atomic():
+            _insert_ancestors(chunk)
+        processed += len(chunk)
+        last_user_id = chunk[-1]
+        if progress is not None:
+            progress(processed)
+
+
+def is_ancestor(ancestor, descendant):
+    """
+    Return whether ``descendant`` reports to ``ancestor`` directly or indirectly.
+
+    Requires the closure table to be enabled.
+    """
+    return UserManagerHierarchy.objects.filter(ancestor=ancestor, descendant=descendant).exists()
+
+
+def subtree_size(manager_field):
+    """
+    Return a subquery counting everyone who reports, directly or indirectly,
+    to the user referenced by ``manager_field`` of the outer query.
+
+    Requires the closure table to be enabled.
+    """
+    return Subquery(
+        UserManagerHierarchy.objects.filter(
+            ancestor_id=OuterRef(manager_field),
+        ).order_by().values('ancestor_id').annotate(size=Count('id')).values('size'),
+        output_field=IntegerField(),
+    )
+
+
+def get_ancestors(user):
+    """
+    Return all users that ``user`` reports to directly or indirectly.
+
+    Requires the closure table to be enabled.
+    """
+    return User.objects.filter(
+        id__in=UserManagerHierarchy.objects.filter(descendant=user).values('ancestor_id'),
+    )
+
+
+def get_descendants(user):
+    """
+    Return all users reporting to ``user`` directly or indirectly.
+
+    Requires the closure table to be enabled.
+    """
+    return User.objects.filter(
+        id__in=UserManagerHierarchy.objects.filter(ancestor=user).values('descendant_id'),
+    )
+
+
+def iter_subtree(direct_reports, max_depth=None, exclude_user_id=None):
+    """
+    Yield ``(user_id, email, depth)`` for all direct and indirect reports.
+
+    Args:
+        direct_reports(QuerySet): ``UserManagerRole`` queryset of the direct
+            reports of the root manager
+        max_depth(int): the deepest level to include, where direct reports are
+            at depth 1. Defaults to ``get_max_subtree_depth()``
+        exclude_user_id(int): user to leave out of the results, normally the
+            root manager, who can only appear as their own report in a cycle
+
+    The subtree is resolved with a single recursive CTE. ``UNION`` removes
+    duplicate ``(user_id, depth)`` rows and the depth bound stops cycles from
+    recursing forever; each user is returned once at the shallowest depth
+    they are reached. Rows are fetched in batches from a server-side cursor
+    where Django provides one (PostgreSQL, unless
+    ``DISABLE_SERVER_SIDE_CURSORS`` is set), so large organisations can be
+    streamed without holding every row in memory. Other databases fall back
+    to a regular cursor, whose driver reads the whole result at once.
+    """
+    if max_depth is None:
+        max_depth = get_max_subtree_depth()
+    anchor_sql, anchor_params = direct_reports.order_by().annotate(
+        depth=Value(1, output_field=IntegerField()),
+    ).values_list('user_id', 'depth').query.sql_with_params()
+
+    quote = connection.ops.quote_name
+    sql = '''
+        WITH RECURSIVE subtree (user_id, depth) AS (
+            {anchor}
+            UNION
+            SELECT report_role.user_id, subtree.depth + 1
+            FROM {role_table} report_role
+            INNER JOIN subtree ON report_role.manager_user_id = subtree.user_id
+            WHERE subtree.depth < %s
+        )
+        SELECT subtree.user_id, auth_user.{email}, MIN(subtree.depth)
+        FROM subtree
+        INNER JOIN {user_table} auth_user ON auth_user.{id} = subtree.user_id
+        GROUP BY subtree.user_id, auth_user.{email}
+        ORDER BY MIN(subtree.depth), subtree.user_id
+    '''.format(
+        anchor=anchor_sql,
+        role_table=quote(UserManagerRole._meta.db_table),
+        user_table=quote(User._meta.db_table),
+        email=quote('email'),
+        id=quote('id'),
+    )
+
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql, tuple(anchor_params) + (max_depth,))
+        while True:
+            rows = cursor.fetchmany(SUBTREE_FETCH_SIZE)
+            if not rows:
+                return
+            for user_id, email, depth in rows:
+                if user_id != exclude_user_id:
+                    yield user_id, email, depth
@@ -0,0 +1,207 @@
+"""
+Opt-in instrumentation of User Manager Application views and roles.
+
+Enable it by listing metric sinks in the ``USER_MANAGER_METRICS_SINKS``
+setting, as dotted paths to sink classes, e.g.::
+
+    USER_MANAGER_METRICS_SINKS = [
+        'user_manager.instrumentation.LogSink',
+        'user_manager.instrumentation.StatsdSink',
+    ]
+
+Every view request then reports its query count, total database time,
+number of serialized rows and response time, and every ``ManagerRole``
+call reports its latency. With no sinks configured, the only overhead is
+a settings lookup per call.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import socket
+import threading
+import timeit
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+log = logging.getLogger(__name__)
+
+VIEW_METRIC = 'view'
+ROLE_METRIC = 'manager_role'
+
+_sinks_cache = {}
+
+
+class LogSink(object):
+    """
+    Log every metric at info level.
+    """
+
+    def emit(self, name, values, tags):
+        log.info(
+            'user_manager.%s %s %s',
+            name,
+            ' '.join('{}={}'.format(key, tags[key]) for key in sorted(tags)),
+            ' '.join('{}={}'.format(key, values[key]) for key in sorted(values)),
+        )
+
+
+class StatsdSink(object):
+    """
+    Send every metric value to StatsD over UDP, durations ending in ``_ms``
+    as timers and other values, such as query and row counts, as counters.
+
+    Configured with ``USER_MANAGER_STATSD_HOST`` (default ``localhost``),
+    ``USER_MANAGER_STATSD_PORT`` (default ``8125``) and
+    ``USER_MANAGER_STATSD_PREFIX`` (default ``user_manager``). Tags are
+    appended to the metric name, so the metrics are
+    ``<prefix>.<name>.<tag values>.<value name>``.
+    """
+
+    def __init__(self):
+        self.address = (
+            getattr(settings, 'USER_MANAGER_STATSD_HOST', 'localhost'),
+            getattr(settings, 'USER_MANAGER_STATSD_PORT', 8125),
+        )
+        self.prefix = getattr(settings, 'USER_MANAGER_STATSD_PREFIX', 'user_manager')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def emit(self, name, values, tags):
+        metric = '.'.join([self.prefix, name] + [str(tags[key]) for key in sorted(tags)])
+        packet = '\n'.join(
+            '{}.{}:{}|{}'.format(metric, key, value, 'ms' if key.endswith('_ms') else 'c')
+            for key, value in sorted(values.items())
+            if value is not None
+        )
+        try:
+            self.socket.sendto(packet.encode('utf-8'), self.address)
+        except socket.error:
+            log.debug('Could not send metrics to %s:%s', *self.address)
+
+
+class MemorySink(object):
+    """
+    Keep every metric in the class-level ``records`` list, for tests.
+    """
+    records = []
+    lock = threading.Lock()
+
+    def emit(self, name, values, tags):
+        with self.lock:
+            self.records.append((name, values, tags))
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            del cls.records[:]
+
+
+def get_sinks():
+    """
+    Return the configured sink instances, or an empty list if disabled.
+    """
+    paths = tuple(getattr(settings, 'USER_MANAGER_METRICS_SINKS', ()))
+    if not paths:
+        return []
+    if paths not in _sinks_cache:
+        _sinks_cache[paths] = [import_string(path)() for path in paths]
+    return _sinks_cache[paths]
+
+
+def emit(name, values, tags):
+    """
+    Send a metric to all configured sinks.
+    """
+    for sink in get_sinks():
+        sink.emit(name, values, tags)
+
+
+@contextmanager
+def capture_db_metrics():
+    """
+    Yield a dict that is filled with the ``queries`` count and total
+    ``db_time_ms`` of the queries run in the block.
+    """
+    metrics = {}
+    if hasattr(connection, 'execute_wrapper'):
+        timings = []
+
+        def wrapper(execute, sql, params, many, context):
+            start = timeit.default_timer()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                timings.append(timeit.default_timer() - start)
+
+        with connection.execute_wrapper(wrapper):
+            yield metrics
+        metrics['queries'] = len(timings)
+        metrics['db_time_ms'] = round(1000 * sum(timings), 3)
+    else:
+        # Django < 2.0 can only time queries through the debug cursor, which
+        # logs them on the connection.
+        force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        connection.ensure_connection()
+        start = len(connection.queries_log)
+        try:
+            yield metrics
+        finally:
+            connection.force_debug_cursor = force_debug_cursor
+        queries = list(connection.queries_log)[start:]
+        metrics['queries'] = len(queries)
+        metrics['db_time_ms'] = round(1000 * sum(float(query['time']) for query in queries), 3)
+
+
+def _count_rows(response):
+    data = getattr(response, 'data', None)
+    if isinstance(data, dict):
+        data = data.get('results')
+    if isinstance(data, list):
+        return len(data)
+    return None
+
+
+class InstrumentedViewMixin(object):
+    """
+    Reports metrics for every request to the view when instrumentation is enabled.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if not get_sinks():
+            return super(InstrumentedViewMixin, self).dispatch(request, *args, **kwargs)
+        start = timeit.default_timer()
+        with capture_db_metrics() as metrics:
+            response = super(InstrumentedViewMixin, self).dispatch(request, *args, **kwargs)
+        # Streamed responses are only timed until they start streaming.
+        metrics['response_time_ms'] = round(1000 * (timeit.default_timer() - start), 3)
+        metrics['rows'] = _count_rows(response)
+        emit(VIEW_METRIC, metrics, {
+            'view': self.__class__.__name__,
+            'method': request.method,
+            'status': response.status_code,
+        })
+        return response
+
+
+def instrument_role_method(func):
+    """
+    Report the latency of a ``ManagerRole`` method when instrumentation is enabled.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not get_sinks():
+            return func(*args, **kwargs)
+        start = timeit.default_timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            emit(
+                ROLE_METRIC,
+                {'latency_ms': round(1000 * (timeit.default_timer() - start), 3)},
+                {'method': func.__name__},
+            )
+    return wrapper
@@ -0,0 +1,222 @@
+"""
+Membership filter of pending manager invites for User Manager Application.
+
+Every new user triggers a lookup of roles linked to their email as an
+unregistered manager, but almost none of them have been invited. A Bloom
+filter of the pending invite emails, shared through Django's cache, lets
+those registrations skip the database entirely.
+
+The filter is built outside of requests by ``build_pending_invite_filter``,
+run on a schedule with the ``build_pending_invite_filter`` command. It is
+stored under a version stamp that is bumped whenever an invite is created,
+so a filter built before the invite existed is never used afterwards.
+Until the next build, registrations fall back to the indexed database
+lookup. Upgraded or deleted invites only make the filter report false
+positives, which fall through to the database, until it expires.
+
+Each process keeps the last filter it read in memory, keyed by version, so
+a registration only reads the version from the shared cache.
+
+The filter takes about 20 bits per pending invite. Memcached refuses items
+over 1MB by default, so a filter larger than
+``USER_MANAGER_INVITE_FILTER_MAX_BYTES`` (1,000,000 by default, about
+400,000 pending invites) is not stored and every registration uses the
+database.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import UserManagerRole, normalize_email
+
+log = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'user_manager.pending_invites.version'
+FILTER_CACHE_KEY = 'user_manager.pending_invites.filter.{version}'
+BUILD_CHUNK_SIZE = 5000
+MIN_CAPACITY = 1000
+ERROR_RATE = 0.01
+
+
+# The ``(version, filter, expires_at)`` of the last filter read by this process.
+_process_filter = (None, None, 0)
+
+
+class BloomFilter(object):
+    """
+    A fixed-size Bloom filter of strings.
+    """
+
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.num_bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.sha1(value.encode('utf-8')).hexdigest()
+        first, second = int(digest[:20], 16), int(digest[20:], 16)
+        for index in range(self.num_hashes):
+            yield (first + index * second) % self.num_bits
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, value):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(value))
+
+
+def get_filter_timeout():
+    """
+    Return how long a pending invite filter is kept for, in seconds.
+
+    The filter is disabled unless ``USER_MANAGER_INVITE_FILTER_TIMEOUT`` is
+    set. Only enable it with a cache shared by all processes, otherwise
+    invites created by one process are not seen by the others.
+    """
+    return getattr(settings, 'USER_MANAGER_INVITE_FILTER_TIMEOUT', 0)
+
+
+def get_filter_max_bytes():
+    """
+    Return the largest filter stored in the cache, in bytes.
+
+    Set ``USER_MANAGER_INVITE_FILTER_MAX_BYTES`` to the item size limit of
+    the cache backend, less some room for the key and pickling.
+    """
+    return getattr(settings, 'USER_MANAGER_INVITE_FILTER_MAX_BYTES', 1000 * 1000)
+
+
+def is_filter_enabled():
+    """
+    Return whether registrations are checked against the pending invite filter.
+    """
+    return get_filter_timeout() != 0
+
+
+def _seed_version():
+    """
+    Store a version if there is none, e.g. because it was evicted.
+
+    Versions start from the current time in microseconds rather than a fixed
+    number, so a version evicted from the cache never comes back and brings
+    back a filter stored under it before newer invites existed.
+    """
+    initial = int(time.time() * 1000000)
+    cache.add(VERSION_CACHE_KEY, initial, None)
+    return initial
+
+
+def _get_version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        initial = _seed_version()
+        version = cache.get(VERSION_CACHE_KEY) or initial
+    return version
+
+
+def _build_filter():
+    """
+    Return a ``BloomFilter`` of all pending invite emails, read in chunks.
+    """
+    pending = UserManagerRole.objects.filter(
+        manager_user__isnull=True,
+    ).exclude(
+        unregistered_manager_email=None,
+    ).order_by('pk').values_list('pk', 'unregistered_manager_email')
+    bloom_filter = BloomFilter(max(MIN_CAPACITY, 2 * pending.count()))
+    last_pk = 0
+    while True:
+        chunk = list(pending.filter(pk__gt=last_pk)[:BUILD_CHUNK_SIZE])
+        if not chunk:
+            return bloom_filter
+        for _, email in chunk:
+            bloom_filter.add(email)
+        last_pk = chunk[-1][0]
+
+
+def build_pending_invite_filter():
+    """
+    Build the filter of all pending invites and store it in the cache.
+
+    Run this outside of requests, e.g. from the ``build_pending_invite_filter``
+    command, more often than ``USER_MANAGER_INVITE_FILTER_TIMEOUT``. The
+    filter is stored under the version read before the invites, so it is
+    never used if an invite is created during the build.
+
+    Returns the filter, or ``None`` if it is disabled or too large to store.
+    """
+    if not is_filter_enabled():
+        return None
+    version = _get_version()
+    bloom_filter = _build_filter()
+    if len(bloom_filter.bits) > get_filter_max_bytes():
+        log.warning(
+            'Not storing the pending invite filter of %d bytes, over USER_MANAGER_INVITE_FILTER_MAX_BYTES',
+            len(bloom_filter.bits),
+        )
+        return None
+    cache.set(FILTER_CACHE_KEY.format(version=version), bloom_filter, get_filter_timeout())
+    return bloom_filter
+
+
+def may_have_pending_invite(email):
+    """
+    Return ``False`` if there is definitely no pending invite for ``email``.
+
+    Returns ``True`` when there is no current filter, so the caller falls
+    back to the database; the filter is never built here.
+    """
+    if not is_filter_enabled() or not email:
+        return True
+    bloom_filter = _get_filter(_get_version())
+    if bloom_filter is None:
+        return True
+    return normalize_email(email) in bloom_filter
+
+
+def _get_filter(version):
+    """
+    Return the filter stored under ``version``, or ``None``.
+
+    The filter is read from the shared cache once per version and process,
+    and then kept in memory until the filter timeout passes.
+    """
+    global _process_filter  # pylint: disable=global-statement
+    cached_version, bloom_filter, expires_at = _process_filter
+    if cached_version == version and time.time() < expires_at:
+        return bloom_filter
+    bloom_filter = cache.get(FILTER_CACHE_KEY.format(version=version))
+    if bloom_filter is not None:
+        _process_filter = (version, bloom_filter, time.time() + get_filter_timeout())
+    return bloom_filter
+
+
+def _bump_version():
+    _seed_version()
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        # Evicted again between the two calls.
+        _seed_version()
+
+
+def invalidate_pending_invites():
+    """
+    Stop using the current filter after new invites were created.
+
+    The version is bumped right away, and again once the transaction commits
+    to discard any filter built in between without the new invites.
+    """
+    if not is_filter_enabled():
+        return
+    _bump_version()
+    transaction.on_commit(_bump_version)
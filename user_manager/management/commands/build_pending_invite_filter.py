@@ -0,0 +1,33 @@
+"""
+Management command to build the pending manager invite filter.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...invites import build_pending_invite_filter, is_filter_enabled
+
+
+class Command(BaseCommand):
+    """
+    Build the Bloom filter of pending invite emails and store it in the cache.
+
+    Run this periodically, e.g. from cron, more often than
+    ``USER_MANAGER_INVITE_FILTER_TIMEOUT``. Registrations use the database
+    while there is no current filter.
+
+    Example::
+
+        ./manage.py lms build_pending_invite_filter
+    """
+    help = 'Build the pending manager invite filter used at registration.'
+
+    def handle(self, *args, **options):
+        if not is_filter_enabled():
+            raise CommandError('Set USER_MANAGER_INVITE_FILTER_TIMEOUT to enable the pending invite filter.')
+        bloom_filter = build_pending_invite_filter()
+        if bloom_filter is None:
+            raise CommandError('The pending invite filter is larger than USER_MANAGER_INVITE_FILTER_MAX_BYTES.')
+        self.stdout.write(self.style.SUCCESS(
+            'Built pending invite filter of {} bytes'.format(len(bloom_filter.bits))
+        ))
@@ -0,0 +1,49 @@
+"""
+Management command to export all user-manager relationships.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import io
+
+from django.core.management.base import BaseCommand
+
+from ...export import CONTENT_TYPES, CSV_FORMAT, EXPORT_CHUNK_SIZE, iter_export_lines
+
+
+class Command(BaseCommand):
+    """
+    Stream every ``UserManagerRole`` as CSV or NDJSON to stdout or a file.
+
+    Example::
+
+        ./manage.py lms export_user_managers --format ndjson --output managers.ndjson
+    """
+    help = 'Export all user-manager relationships as CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            dest='export_format',
+            choices=sorted(CONTENT_TYPES),
+            default=CSV_FORMAT,
+            help='Output format.',
+        )
+        parser.add_argument(
+            '--output',
+            help='File to write the export to. Defaults to stdout.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help='Number of rows to fetch from the database at a time.',
+        )
+
+    def handle(self, *args, **options):
+        lines = iter_export_lines(options['export_format'], options['chunk_size'])
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
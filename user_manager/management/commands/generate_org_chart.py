@@ -0,0 +1,92 @@
+"""
+Management command to generate a synthetic organisation for load testing.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ...synthetic import CHUNK_SIZE, FANOUT_DISTRIBUTIONS, PARETO, OrgShape, generate_org
+
+
+class Command(BaseCommand):
+    """
+    Fill the database with synthetic users and manager links.
+
+    Example::
+
+        ./manage.py lms generate_org_chart --roles 1000000 --depth 7 --workers 8
+    """
+    help = 'Generate synthetic users and user-manager relationships for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--roles', type=int, required=True, help='Approximate number of manager links.')
+        parser.add_argument('--depth', type=int, default=5, help='Number of levels in the hierarchy.')
+        parser.add_argument(
+            '--fanout-distribution',
+            choices=FANOUT_DISTRIBUTIONS,
+            default=PARETO,
+            help='How reports are spread over the managers of a level.',
+        )
+        parser.add_argument(
+            '--fanout-skew',
+            type=float,
+            default=1.2,
+            help='Shape of the pareto fan-out distribution; lower is more skewed.',
+        )
+        parser.add_argument(
+            '--multi-manager-share',
+            type=float,
+            default=0.05,
+            help='Share of users with a second manager.',
+        )
+        parser.add_argument(
+            '--unregistered-share',
+            type=float,
+            default=0.02,
+            help='Share of links to an unregistered manager email.',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+        parser.add_argument(
+            '--prefix',
+            default='synthetic',
+            help='Prefix of generated usernames and emails, which must not already exist.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Number of users per bulk insert and transaction.',
+        )
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker processes.')
+
+    def handle(self, *args, **options):
+        try:
+            shape = OrgShape(
+                num_roles=options['roles'],
+                depth=options['depth'],
+                fanout_distribution=options['fanout_distribution'],
+                fanout_skew=options['fanout_skew'],
+                multi_manager_share=options['multi_manager_share'],
+                unregistered_share=options['unregistered_share'],
+                seed=options['seed'],
+                prefix=options['prefix'],
+            )
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        workers = options['workers']
+        if workers > 1 and connection.vendor == 'sqlite':
+            self.stderr.write('SQLite does not support concurrent writers, using a single worker.')
+            workers = 1
+
+        totals = {'users': 0, 'roles': 0}
+
+        def progress(phase, count):
+            totals[phase] += count
+            self.stdout.write('{}: processed {} of {} users'.format(phase, totals[phase], shape.num_users))
+
+        generate_org(shape, chunk_size=options['chunk_size'], workers=workers, progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            'Generated {} users in {} levels'.format(shape.num_users, shape.depth)
+        ))
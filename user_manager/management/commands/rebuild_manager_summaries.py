@@ -0,0 +1,38 @@
+"""
+Management command to rebuild the manager summary table.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from ...summary import SUMMARY_CHUNK_SIZE, rebuild_manager_summaries
+
+
+class Command(BaseCommand):
+    """
+    Rebuild ``ManagerSummary`` from scratch.
+
+    Run this before enabling ``USER_MANAGER_SUMMARY_ENABLED``, and if the
+    summary table has got out of sync with the role table, e.g. after editing
+    roles directly in the database.
+
+    Example::
+
+        ./manage.py lms rebuild_manager_summaries --chunk-size 1000
+    """
+    help = 'Rebuild the manager summary table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=SUMMARY_CHUNK_SIZE,
+            help='Number of managers to process in each transaction.',
+        )
+
+    def handle(self, *args, **options):
+        def progress(processed):
+            self.stdout.write('Processed {} managers'.format(processed))
+
+        processed = rebuild_manager_summaries(options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS('Rebuilt summaries for {} managers'.format(processed)))
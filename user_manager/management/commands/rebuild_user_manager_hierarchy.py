@@ -0,0 +1,37 @@
+"""
+Management command to rebuild the reporting hierarchy closure table.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from ...hierarchy import HIERARCHY_CHUNK_SIZE, rebuild_hierarchy
+
+
+class Command(BaseCommand):
+    """
+    Rebuild ``UserManagerHierarchy`` from scratch.
+
+    Run this after enabling ``USER_MANAGER_HIERARCHY_ENABLED`` or if the
+    closure table has got out of sync.
+
+    Example::
+
+        ./manage.py lms rebuild_user_manager_hierarchy --chunk-size 1000
+    """
+    help = 'Rebuild the user manager hierarchy closure table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=HIERARCHY_CHUNK_SIZE,
+            help='Number of users to process in each transaction.',
+        )
+
+    def handle(self, *args, **options):
+        def progress(processed):
+            self.stdout.write('Processed {} users'.format(processed))
+
+        processed = rebuild_hierarchy(options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS('Rebuilt hierarchy for {} users'.format(processed)))
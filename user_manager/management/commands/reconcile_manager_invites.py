@@ -0,0 +1,52 @@
+"""
+Management command to upgrade pending manager invites for registered users.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from ...utils import RECONCILE_BATCH_SIZE, reconcile_manager_invites
+
+
+class Command(BaseCommand):
+    """
+    Upgrade every ``unregistered_manager_email`` that belongs to a registered user.
+
+    Safe to run periodically, e.g. from cron.
+
+    Example::
+
+        ./manage.py lms reconcile_manager_invites --batch-size 5000 --dry-run
+    """
+    help = 'Upgrade pending manager invites whose email belongs to a registered user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=RECONCILE_BATCH_SIZE,
+            help='Number of invites to process in each transaction.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the invites that would be upgraded.',
+        )
+
+    def handle(self, *args, **options):
+        message = (
+            'Processed {processed} invites: {upgraded} upgraded, '
+            '{duplicates} duplicates removed, {unresolved} unresolved'
+        )
+        if options['dry_run']:
+            message = '[dry run] ' + message
+
+        def progress(totals):
+            self.stdout.write(message.format(**totals))
+
+        totals = reconcile_manager_invites(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(message.format(**totals)))
@@ -0,0 +1,107 @@
+"""
+Request-scoped memoization of ManagerRole lookups for User Manager Application.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.utils.deprecation import MiddlewareMixin
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class RoleMemo(object):
+    """
+    In-memory store of lookup results, with hit and miss counters.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the stored value for ``key``, calling ``compute`` to get it on a miss.
+        """
+        if key in self.values:
+            self.hits += 1
+            return self.values[key]
+        self.misses += 1
+        value = self.values[key] = compute()
+        return value
+
+    def clear(self):
+        """
+        Forget all stored values, keeping the counters.
+        """
+        self.values.clear()
+
+
+def get_current_memo():
+    """
+    Return the active ``RoleMemo``, or ``None`` outside of ``memoize_manager_roles``.
+    """
+    return getattr(_local, 'memo', None)
+
+
+def memoized(key, compute):
+    """
+    Return ``compute()``, memoized under ``key`` if a ``RoleMemo`` is active.
+    """
+    memo = get_current_memo()
+    if memo is None:
+        return compute()
+    return memo.get_or_compute(key, compute)
+
+
+def clear_current_memo():
+    """
+    Forget the values of the active ``RoleMemo`` after manager links change.
+    """
+    memo = get_current_memo()
+    if memo is not None:
+        memo.clear()
+
+
+@contextmanager
+def memoize_manager_roles():
+    """
+    Memoize ``ManagerRole`` lookups for the duration of the block.
+
+    Nested blocks share the outer ``RoleMemo``, which is yielded so its
+    ``hits`` and ``misses`` can be inspected.
+    """
+    previous = get_current_memo()
+    memo = previous if previous is not None else RoleMemo()
+    _local.memo = memo
+    try:
+        yield memo
+    finally:
+        _local.memo = previous
+
+
+class ManagerRoleMemoMiddleware(MiddlewareMixin):
+    """
+    Memoize ``ManagerRole`` lookups for each request.
+
+    The ``RoleMemo`` is available as ``request.manager_role_memo``, and its
+    counters are logged at debug level when the response is returned.
+    """
+
+    def process_request(self, request):
+        _local.memo = request.manager_role_memo = RoleMemo()
+
+    def process_response(self, request, response):
+        memo = getattr(request, 'manager_role_memo', None)
+        if memo is not None:
+            log.debug(
+                'ManagerRole memo for %s: %d hits, %d misses',
+                request.path, memo.hits, memo.misses,
+            )
+        _local.memo = None
+        return response
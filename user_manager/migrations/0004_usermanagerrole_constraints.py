@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Enforce the ``UserManagerRole`` invariants checked by ``clean()`` in the database,
+so writes can rely on the database instead of validating with extra queries.
+"""
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import F, Q
+
+TABLE = 'user_manager_usermanagerrole'
+
+# ``{row}`` is replaced by ``NEW.`` in SQLite triggers.
+NOT_SELF_CHECK = '{row}manager_user_id IS NULL OR {row}manager_user_id <> {row}user_id'
+ONE_MANAGER_CHECK = (
+    '({row}manager_user_id IS NOT NULL AND {row}unregistered_manager_email IS NULL) OR '
+    '({row}manager_user_id IS NULL AND {row}unregistered_manager_email IS NOT NULL)'
+)
+CONSTRAINTS = (
+    ('user_manager_role_not_self', NOT_SELF_CHECK),
+    ('user_manager_role_one_manager', ONE_MANAGER_CHECK),
+)
+
+
+def clean_existing_roles(apps, schema_editor):  # pylint: disable=unused-argument
+    """
+    Fix up rows that would violate the new constraints.
+    """
+    UserManagerRole = apps.get_model('user_manager', 'UserManagerRole')
+    UserManagerRole.objects.filter(manager_user_id__isnull=False).exclude(
+        unregistered_manager_email=None,
+    ).update(unregistered_manager_email=None)
+    UserManagerRole.objects.filter(
+        Q(manager_user_id__isnull=True, unregistered_manager_email=None) |
+        Q(manager_user_id__isnull=True, unregistered_manager_email='')
+    ).delete()
+    UserManagerRole.objects.filter(manager_user_id=F('user_id')).delete()
+
+
+def add_constraints(apps, schema_editor):  # pylint: disable=unused-argument
+    """
+    Add the check constraints, emulated with triggers on SQLite, which can't
+    add constraints to an existing table.
+    """
+    if schema_editor.connection.vendor == 'sqlite':
+        for name, check in CONSTRAINTS:
+            for operation in ('INSERT', 'UPDATE'):
+                schema_editor.execute(
+                    'CREATE TRIGGER {name}_{op} BEFORE {operation} ON {table} '
+                    'WHEN NOT ({check}) '
+                    "BEGIN SELECT RAISE(ABORT, 'CHECK constraint failed: {name}'); END".format(
+                        name=name,
+                        op=operation.lower(),
+                        operation=operation,
+                        table=TABLE,
+                        check=check.format(row='NEW.'),
+                    )
+                )
+    else:
+        for name, check in CONSTRAINTS:
+            schema_editor.execute(
+                'ALTER TABLE {table} ADD CONSTRAINT {name} CHECK ({check})'.format(
+                    table=TABLE,
+                    name=name,
+                    check=check.format(row=''),
+                )
+            )
+
+
+def _mysql_drop_check(connection, name):
+    """
+    Return the statement dropping the check constraint ``name`` on MySQL, or
+    ``None`` if the server ignored it.
+
+    MySQL only keeps check constraints from 8.0.16 and MariaDB from 10.2, so
+    older servers have nothing to drop. MySQL 8.0.16 to 8.0.18 only support
+    ``DROP CHECK``, and MariaDB only supports ``DROP CONSTRAINT``.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT COUNT(*) FROM information_schema.TABLE_CONSTRAINTS '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_NAME = %s',
+            [TABLE, name],
+        )
+        if not cursor.fetchone()[0]:
+            return None
+        cursor.execute('SELECT VERSION()')
+        is_mariadb = 'mariadb' in cursor.fetchone()[0].lower()
+    return 'ALTER TABLE {} DROP {} {}'.format(TABLE, 'CONSTRAINT' if is_mariadb else 'CHECK', name)
+
+
+def remove_constraints(apps, schema_editor):  # pylint: disable=unused-argument
+    """
+    Drop the check constraints, or their triggers on SQLite.
+    """
+    vendor = schema_editor.connection.vendor
+    for name, _ in CONSTRAINTS:
+        if vendor == 'sqlite':
+            schema_editor.execute('DROP TRIGGER IF EXISTS {}_insert'.format(name))
+            schema_editor.execute('DROP TRIGGER IF EXISTS {}_update'.format(name))
+        elif vendor == 'mysql':
+            statement = _mysql_drop_check(schema_editor.connection, name)
+            if statement is not None:
+                schema_editor.execute(statement)
+        else:
+            schema_editor.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(TABLE, name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_manager', '0003_usermanagerhierarchy'),
+    ]
+
+    operations = [
+        migrations.RunPython(clean_existing_roles, migrations.RunPython.noop),
+        migrations.RunPython(add_constraints, remove_constraints),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_manager', '0004_usermanagerrole_constraints'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usermanagerrole',
+            index=models.Index(fields=['unregistered_manager_email'], name='user_manager_unreg_email_idx'),
+        ),
+    ]
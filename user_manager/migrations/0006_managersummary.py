@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+
+def populate_summaries(apps, schema_editor):  # pylint: disable=unused-argument
+    """
+    Count the reports of every existing manager.
+    """
+    UserManagerRole = apps.get_model('user_manager', 'UserManagerRole')
+    ManagerSummary = apps.get_model('user_manager', 'ManagerSummary')
+    registered = UserManagerRole.objects.filter(manager_user__isnull=False).order_by().values_list(
+        'manager_user_id',
+    ).annotate(reports=Count('id'))
+    ManagerSummary.objects.bulk_create(
+        (ManagerSummary(manager_user_id=manager_id, report_count=reports) for manager_id, reports in registered),
+        batch_size=BATCH_SIZE,
+    )
+    unregistered = UserManagerRole.objects.filter(manager_user__isnull=True).order_by().values_list(
+        'unregistered_manager_email',
+    ).annotate(reports=Count('id'))
+    ManagerSummary.objects.bulk_create(
+        (ManagerSummary(unregistered_manager_email=email, report_count=reports) for email, reports in unregistered),
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('user_manager', '0005_usermanagerrole_unregistered_email_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ManagerSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unregistered_manager_email', models.EmailField(blank=True, max_length=254, null=True, unique=True)),
+                ('report_count', models.PositiveIntegerField(default=0)),
+                ('manager_user', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(populate_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Add a reverse relation from managers to their ``UserManagerRole`` rows.
+
+Only the migration state changes: on SQLite altering the field would rebuild
+the table and drop the triggers added in ``0004``.
+"""
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('user_manager', '0006_managersummary'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='usermanagerrole',
+                    name='manager_user',
+                    field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='user_manager_reports', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+    ]
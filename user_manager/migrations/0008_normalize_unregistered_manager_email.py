@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Store ``unregistered_manager_email`` trimmed and lowercased, so that email
+lookups can be exact matches on its index.
+"""
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count
+
+CHUNK_SIZE = 1000
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def normalize_emails(apps, schema_editor):  # pylint: disable=unused-argument
+    """
+    Normalize the emails of pending invites in chunks, removing invites that
+    duplicate another one once normalized, then recount the invite summaries.
+    """
+    UserManagerRole = apps.get_model('user_manager', 'UserManagerRole')
+    ManagerSummary = apps.get_model('user_manager', 'ManagerSummary')
+    pending = UserManagerRole.objects.filter(
+        unregistered_manager_email__isnull=False,
+    ).order_by('pk').values_list('pk', 'user_id', 'unregistered_manager_email')
+    last_pk = 0
+    while True:
+        chunk = list(pending.filter(pk__gt=last_pk)[:CHUNK_SIZE])
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        changed = [
+            (pk, user_id, normalize_email(email))
+            for pk, user_id, email in chunk
+            if normalize_email(email) != email
+        ]
+        if not changed:
+            continue
+        # Case-insensitive collations also match the rows being changed.
+        existing = set(UserManagerRole.objects.filter(
+            user_id__in=set(user_id for _, user_id, _ in changed),
+            unregistered_manager_email__in=set(email for _, _, email in changed),
+        ).exclude(
+            pk__in=[pk for pk, _, _ in changed],
+        ).values_list('user_id', 'unregistered_manager_email'))
+        duplicates = []
+        for pk, user_id, email in changed:
+            if (user_id, email) in existing:
+                duplicates.append(pk)
+            else:
+                existing.add((user_id, email))
+                UserManagerRole.objects.filter(pk=pk).update(unregistered_manager_email=email)
+        UserManagerRole.objects.filter(pk__in=duplicates).delete()
+
+    ManagerSummary.objects.filter(manager_user__isnull=True).delete()
+    unregistered = UserManagerRole.objects.filter(manager_user__isnull=True).order_by().values_list(
+        'unregistered_manager_email',
+    ).annotate(reports=Count('id'))
+    ManagerSummary.objects.bulk_create(
+        (ManagerSummary(unregistered_manager_email=email, report_count=reports) for email, reports in unregistered),
+        batch_size=CHUNK_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_manager', '0007_usermanagerrole_manager_user_related_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_emails, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Index ``UserManagerRole`` for the list views, and order it by primary key.
+
+Pending invites get a partial index on PostgreSQL and SQLite. MySQL has no
+partial indexes, so it keeps using ``user_manager_unreg_email_idx``.
+"""
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+TABLE = 'user_manager_usermanagerrole'
+PENDING_INVITE_INDEX = 'user_manager_pending_invite_idx'
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+
+def add_pending_invite_index(apps, schema_editor):  # pylint: disable=unused-argument
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute(
+            'CREATE INDEX {name} ON {table} (unregistered_manager_email, user_id) '
+            'WHERE manager_user_id IS NULL'.format(name=PENDING_INVITE_INDEX, table=TABLE)
+        )
+
+
+def remove_pending_invite_index(apps, schema_editor):  # pylint: disable=unused-argument
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute('DROP INDEX {name}'.format(name=PENDING_INVITE_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_manager', '0008_normalize_unregistered_manager_email'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='usermanagerrole',
+            options={'ordering': ['id']},
+        ),
+        migrations.AddIndex(
+            model_name='usermanagerrole',
+            index=models.Index(fields=['manager_user', 'user'], name='user_manager_manager_user_idx'),
+        ),
+        migrations.RunPython(add_pending_invite_index, remove_pending_invite_index),
+    ]
@@ -3,9 +3,19 @@ Models for User Manager Application.
 """
 from __future__ import absolute_import, unicode_literals
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import IntegrityError, models, transaction
+
+
+def normalize_email(email):
+    """
+    Return ``email`` trimmed and lowercased, as stored for unregistered managers.
+    """
+    if not email:
+        return email
+    return email.strip().lower()
 
 
 class UserManagerRole(models.Model):
@@ -17,6 +27,15 @@ class UserManagerRole(models.Model):
         In case the manager doesn't have an account registered in the system,
         their email will be linked instead, and auto-upgraded to a foreign key
         when they register an account.
+
+    Besides the unique constraints, the database checks that a user is not
+    their own manager and that exactly one of ``manager_user`` and
+    ``unregistered_manager_email`` is set (see migration ``0004``).
+
+    Pending invites are also indexed on ``(unregistered_manager_email, user)``
+    where ``manager_user`` is null, on databases with partial indexes (see
+    migration ``0009``). Invite lookups filter on ``manager_user__isnull=True``
+    so they can use it.
     """
     user = models.ForeignKey(
         User,
@@ -28,10 +47,11 @@ class UserManagerRole(models.Model):
         null=True,
         blank=True,
         on_delete=models.CASCADE,
-        related_name='+',
+        related_name='user_manager_reports',
     )
     # This will get upgraded to a foreign key to the manager's user account
-    # when they register.
+    # when they register. Stored normalized by ``normalize_email`` so that
+    # lookups can use the index on this column.
     unregistered_manager_email = models.EmailField(
         null=True,
         blank=True,
@@ -41,11 +61,18 @@ class UserManagerRole(models.Model):
 
     class Meta(object):
         app_label = 'user_manager'
-        ordering = ['manager_user']
+        ordering = ['id']
+        # The first unique constraint also indexes the managers of a user.
         unique_together = (
             ('user', 'manager_user'),
             ('user', 'unregistered_manager_email'),
         )
+        indexes = [
+            # Used to upgrade pending invites when a manager registers.
+            models.Index(fields=['unregistered_manager_email'], name='user_manager_unreg_email_idx'),
+            # Used to list the reports of a manager in order.
+            models.Index(fields=['manager_user', 'user'], name='user_manager_manager_user_idx'),
+        ]
 
     def __unicode__(self):
         return '{user} reports to {manager}'.format(
@@ -54,8 +81,30 @@ class UserManagerRole(models.Model):
         )
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
-        self.full_clean()
-        super(UserManagerRole, self).save(force_insert, force_update, using, update_fields)
+        """
+        Validate and save the role.
+
+        By default the role is validated with ``full_clean()`` first, which
+        costs a query per unique constraint. With the
+        ``USER_MANAGER_FAST_WRITES`` setting enabled, the database constraints
+        are relied on instead, and ``full_clean()`` is only run when they are
+        violated, to raise the same ``ValidationError``. The user is then
+        only compared to an unregistered manager email if it is already
+        loaded, as the database can't check that either.
+        """
+        self.unregistered_manager_email = normalize_email(self.unregistered_manager_email)
+        if not getattr(settings, 'USER_MANAGER_FAST_WRITES', False):
+            self.full_clean()
+            super(UserManagerRole, self).save(force_insert, force_update, using, update_fields)
+            return
+
+        self._check_manager(load_user=False)
+        try:
+            with transaction.atomic(using=using):
+                super(UserManagerRole, self).save(force_insert, force_update, using, update_fields)
+        except IntegrityError:
+            self.full_clean()
+            raise
 
     @property
     def manager_email(self):
@@ -65,8 +114,96 @@ class UserManagerRole(models.Model):
             return self.unregistered_manager_email
 
     def clean(self):
-        if (
-                self.user == self.manager_user or
-                self.user.email == self.unregistered_manager_email
-        ):
+        self._check_manager()
+
+    def _check_manager(self, load_user=True):
+        """
+        Raise a ``ValidationError`` unless the role has exactly one manager,
+        other than the user. Without ``load_user``, an unregistered manager
+        email is only compared to the user's if the user is already loaded.
+        """
+        if (self.manager_user_id is None) == (self.unregistered_manager_email is None):
+            raise ValidationError('Exactly one of a manager user or email is required')
+        if self.manager_user_id is not None:
+            is_own_manager = self.user_id == self.manager_user_id
+        else:
+            is_own_manager = (
+                self.user_id is not None and
+                (load_user or UserManagerRole.user.is_cached(self)) and
+                normalize_email(self.user.email) == normalize_email(self.unregistered_manager_email)
+            )
+        if is_own_manager:
             raise ValidationError('User cannot be own manager')
+
+
+class UserManagerHierarchy(models.Model):
+    """
+    Closure table of the reporting hierarchy between registered users.
+
+    Holds a row for every user that reports to ``ancestor`` directly or
+    indirectly, with the length of the shortest reporting chain between
+    them as ``depth``. It is only maintained when the
+    ``USER_MANAGER_HIERARCHY_ENABLED`` setting is on; see
+    :mod:`user_manager.hierarchy`.
+    """
+    ancestor = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    descendant = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    depth = models.PositiveIntegerField()
+
+    class Meta(object):
+        app_label = 'user_manager'
+        unique_together = (
+            ('ancestor', 'descendant'),
+        )
+        index_together = (
+            ('descendant', 'ancestor'),
+        )
+
+    def __unicode__(self):
+        return '{descendant} reports to {ancestor} at depth {depth}'.format(
+            descendant=self.descendant_id,
+            ancestor=self.ancestor_id,
+            depth=self.depth,
+        )
+
+
+class ManagerSummary(models.Model):
+    """
+    One row for every distinct manager, with their number of direct reports.
+
+    Kept up to date with ``UserManagerRole`` by
+    :func:`user_manager.summary.update_manager_summaries` when the
+    ``USER_MANAGER_SUMMARY_ENABLED`` setting is on, so listing all managers
+    doesn't need to scan and de-duplicate the whole role table.
+    """
+    manager_user = models.OneToOneField(
+        User,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    unregistered_manager_email = models.EmailField(
+        null=True,
+        blank=True,
+        unique=True,
+    )
+    report_count = models.PositiveIntegerField(default=0)
+
+    class Meta(object):
+        app_label = 'user_manager'
+        ordering = ['id']
+
+    def __unicode__(self):
+        return '{manager} has {count} reports'.format(
+            manager=self.manager_user_id or self.unregistered_manager_email,
+            count=self.report_count,
+        )
@@ -8,7 +8,47 @@ from django.db.models import Q
 
 from student.roles import AccessRole
 
-from .models import UserManagerRole
+from .cache import get_managers, is_cache_enabled
+from .instrumentation import instrument_role_method
+from .memo import memoized
+from .models import ManagerSummary, UserManagerRole, normalize_email
+from .summary import is_summary_enabled
+from .utils import LOOKUP_CHUNK_SIZE, bulk_create_roles, delete_user_manager_roles
+
+MANAGER_CHUNK_SIZE = 1000
+
+
+def managed_user_ids(manager):
+    """
+    Return a queryset of the ids of users managed by ``manager``, either
+    directly or through an invite to their email address.
+
+    The queryset isn't evaluated, so it can be used as a subquery, e.g.
+    ``User.objects.filter(id__in=managed_user_ids(viewer))``.
+    """
+    return UserManagerRole.objects.filter(
+        Q(manager_user=manager) |
+        Q(manager_user__isnull=True, unregistered_manager_email=normalize_email(manager.email))
+    ).values('user_id')
+
+
+@instrument_role_method
+def filter_managed_users(manager, user_ids):
+    """
+    Return the set of ``user_ids`` that ``manager`` manages, directly or
+    through an invite to their email address, using a single query.
+
+    This is the batch equivalent of calling ``ManagerRole(user).has_user(manager)``
+    for every user. Large lists are intersected with all the reports of the
+    manager instead of being sent as query parameters.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return set()
+    query = managed_user_ids(manager).values_list('user_id', flat=True)
+    if len(user_ids) <= LOOKUP_CHUNK_SIZE:
+        return set(query.filter(user_id__in=user_ids))
+    return user_ids.intersection(query)
 
 
 class ManagerRole(AccessRole):
@@ -26,16 +66,36 @@ class ManagerRole(AccessRole):
         """
         self.managed_user = managed_user
 
+    def _memo_key(self, name, *args):
+        managed_user_id = self.managed_user.pk if self.managed_user is not None else None
+        return (name, managed_user_id) + args
+
     def _filter_by_managed_user(self, query):
         if self.managed_user is not None:
             return query.filter(user=self.managed_user)
         return query
 
+    @instrument_role_method
     def has_user(self, user):
         """
         Return whether the supplied user is a manager for ``managed_user``.
+
+        The managers of ``managed_user`` are served from the cache when it
+        is enabled, and the result is memoized within a request.
         """
-        is_manager = Q(manager_user=user) | Q(unregistered_manager_email=user.email)
+        return memoized(
+            self._memo_key('has_user', user.pk, user.email),
+            lambda: self._has_user(user),
+        )
+
+    def _has_user(self, user):
+        if self.managed_user is not None and is_cache_enabled():
+            manager_ids, manager_emails = get_managers(self.managed_user.pk)
+            return user.pk in manager_ids or normalize_email(user.email) in manager_emails
+        is_manager = Q(manager_user=user) | Q(
+            manager_user__isnull=True,
+            unregistered_manager_email=normalize_email(user.email),
+        )
         query = self._filter_by_managed_user(
             UserManagerRole.objects.filter(is_manager)
         )
@@ -43,51 +103,94 @@ class ManagerRole(AccessRole):
 
     has_manager = has_user
 
+    @instrument_role_method
     def add_users(self, *users):
         """
         Add the supplied users as managers for ``managed_user``.
+
+        Existing links are skipped. Returns the list of ``UserManagerRole``
+        objects that were created.
         """
         if self.managed_user is None:
-            return
-        for manager in users:
-            UserManagerRole.objects.create(
-                user=self.managed_user,
-                manager_user=manager,
-            )
+            return []
+        return bulk_create_roles(
+            UserManagerRole(user_id=self.managed_user.pk, manager_user_id=manager.pk)
+            for manager in users
+        )
 
     add_manager = add_users
 
+    @instrument_role_method
     def add_direct_report(self, *users):
+        """
+        Add the supplied users as direct reports of ``managed_user``.
+
+        Existing links are skipped. Returns the list of ``UserManagerRole``
+        objects that were created.
+        """
         if self.managed_user is None:
-            return
-        for user in users:
-            UserManagerRole.objects.create(
-                user=user,
-                manager_user=self.managed_user,
-            )
+            return []
+        return bulk_create_roles(
+            UserManagerRole(user_id=user.pk, manager_user_id=self.managed_user.pk)
+            for user in users
+        )
 
+    @instrument_role_method
     def remove_users(self, *users):
         """
         Remove the supplied users as managers for ``managed_user``.
 
         If no ``managed_user`` was supplied, remove them as managers for all users.
         """
-        self._filter_by_managed_user(
+        delete_user_manager_roles(self._filter_by_managed_user(
             UserManagerRole.objects.filter(manager_user__in=users)
-        ).delete()
+        ))
 
+    @instrument_role_method
     def users_with_role(self):
         """
         Return all the users that can manage the ``managed_user``.
 
         If no ``managed_user`` was supplied, return all users that are managers
         for any user.
+
+        Within a request the same queryset is returned on every call, so it is
+        only evaluated once.
         """
-        manager_ids = self._filter_by_managed_user(
-            UserManagerRole.objects.all()
-        ).filter(
-            manager_user__isnull=False,
-        ).values_list('manager_user', flat=True)
-        return User.objects.filter(ids__in=manager_ids)
+        return memoized(self._memo_key('users_with_role'), self._users_with_role)
+
+    def _users_with_role(self):
+        if self.managed_user is not None:
+            # (user, manager_user) is unique, so the join can't repeat a manager.
+            return User.objects.filter(user_manager_reports__user=self.managed_user)
+        return User.objects.filter(user_manager_reports__manager_user__isnull=False).distinct()
 
     get_managers = users_with_role
+
+    def iter_managers(self, chunk_size=MANAGER_CHUNK_SIZE):
+        """
+        Iterate over the users that can manage the ``managed_user``.
+
+        If no ``managed_user`` was supplied, iterate over all users that are
+        managers for any user, in chunks of ``chunk_size`` users read in
+        id order from the manager summary table, or the role table's index on
+        ``manager_user`` when the summary is disabled, so the whole role table
+        is never scanned or de-duplicated at once.
+        """
+        if self.managed_user is not None:
+            for manager in self._users_with_role().iterator():
+                yield manager
+            return
+        if is_summary_enabled():
+            manager_ids = ManagerSummary.objects.filter(manager_user__isnull=False)
+        else:
+            manager_ids = UserManagerRole.objects.filter(manager_user__isnull=False).distinct()
+        manager_ids = manager_ids.order_by('manager_user_id').values_list('manager_user_id', flat=True)
+        last_manager_id = 0
+        while True:
+            chunk = list(manager_ids.filter(manager_user_id__gt=last_manager_id)[:chunk_size])
+            if not chunk:
+                return
+            for manager in User.objects.filter(id__in=chunk).order_by('id'):
+                yield manager
+            last_manager_id = chunk[-1]
@@ -4,10 +4,14 @@ Signals for User Manager app
 from __future__ import absolute_import, unicode_literals
 
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
-from .models import UserManagerRole
+from .cache import is_versioning_enabled
+from .invites import invalidate_pending_invites, may_have_pending_invite
+from .models import UserManagerRole, normalize_email
+from .summary import is_summary_enabled
+from .utils import defer_manager_invite_upgrade, handle_roles_changed, needs_changed_user_ids
 
 
 @receiver(post_save, sender=User)
@@ -15,14 +19,70 @@ def upgrade_manager_role_entry(sender, **kwargs):  # pylint: disable=unused-argu
     """
     Upgrade an unregistered_manager_email link to a proper link to a
     manager user account, when a manager registers.
+
+    Registrations without a pending invite skip the database when the
+    pending invite filter is enabled. Inside ``defer_manager_invite_upgrades``
+    the upgrade is queued instead.
     """
     created = kwargs.get('created')
     user = kwargs.get('instance')
 
-    if created and user:
-        UserManagerRole.objects.filter(
-            unregistered_manager_email=user.email
-        ).update(
+    if created and user and may_have_pending_invite(user.email):
+        if defer_manager_invite_upgrade(user.email):
+            return
+        email = normalize_email(user.email)
+        query = UserManagerRole.objects.filter(
+            manager_user__isnull=True,
+            unregistered_manager_email=email,
+        )
+        upgraded_user_ids = []
+        if needs_changed_user_ids():
+            upgraded_user_ids = list(query.values_list('user_id', flat=True))
+        upgraded = query.update(
             unregistered_manager_email=None,
             manager_user=user,
         )
+        handle_roles_changed(
+            upgraded_user_ids,
+            added=[(user.pk, None)] * upgraded,
+            removed=[(None, email)] * upgraded,
+        )
+
+
+@receiver(pre_save, sender=UserManagerRole)
+def remember_previous_manager(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Remember the manager a saved link had, when an existing link is changed,
+    so ``handle_user_manager_role_change`` can update the old manager too.
+
+    Only the manager summaries and version stamps are kept per manager, so
+    the previous manager is not read unless one of them is enabled.
+    """
+    if not (is_summary_enabled() or is_versioning_enabled()):
+        return
+    if not instance._state.adding:  # pylint: disable=protected-access
+        instance.previous_manager = UserManagerRole.objects.filter(pk=instance.pk).values_list(
+            'manager_user_id',
+            'unregistered_manager_email',
+        ).first()
+
+
+@receiver(post_save, sender=UserManagerRole)
+@receiver(post_delete, sender=UserManagerRole)
+def handle_user_manager_role_change(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Keep the manager summaries, hierarchy closure table, cache, request memo
+    and pending invite filter in sync when a manager link is saved or deleted.
+    """
+    manager = (instance.manager_user_id, instance.unregistered_manager_email)
+    saved = 'created' in kwargs
+    if not saved:
+        handle_roles_changed([instance.user_id], removed=[manager])
+    elif kwargs['created']:
+        handle_roles_changed([instance.user_id], added=[manager])
+    else:
+        previous = getattr(instance, 'previous_manager', None)
+        removed = [previous] if previous is not None else []
+        handle_roles_changed([instance.user_id], added=[manager], removed=removed)
+    if saved and instance.manager_user_id is None:
+        invalidate_pending_invites()
@@ -0,0 +1,205 @@
+"""
+Maintenance of the manager summary table for User Manager Application.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+from .models import ManagerSummary, UserManagerRole
+
+SUMMARY_CHUNK_SIZE = 500
+
+
+def is_summary_enabled():
+    """
+    Return whether the ``ManagerSummary`` table is maintained and used to
+    list managers.
+
+    Enable with ``USER_MANAGER_SUMMARY_ENABLED``, after filling the table
+    with the ``rebuild_manager_summaries`` command.
+    """
+    return getattr(settings, 'USER_MANAGER_SUMMARY_ENABLED', False)
+
+
+def _chunks(items, chunk_size=SUMMARY_CHUNK_SIZE):
+    items = sorted(items)
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def _summary_key(manager_id, email):
+    if manager_id is not None:
+        return 'manager_user_id', manager_id
+    return 'unregistered_manager_email', email
+
+
+def _add_reports(field, delta, keys, retry=True):
+    """
+    Add ``delta`` reports to the managers whose ``field`` is in ``keys``.
+
+    The counts are changed relative to the stored value, so concurrent
+    transactions changing the same manager don't lose each other's changes.
+    Missing rows are inserted, and rows left without reports are removed.
+    """
+    summaries = ManagerSummary.objects.filter(**{field + '__in': keys})
+    if delta < 0:
+        summaries.update(report_count=Case(
+            When(report_count__gt=-delta, then=F('report_count') + delta),
+            default=Value(0),
+            output_field=IntegerField()
+        ))
+        summaries.filter(report_count=0).delete()
+        return
+    if summaries.update(report_count=F('report_count') + delta) == len(keys):
+        return
+    existing = set(summaries.values_list(field, flat=True))
+    missing = [key for key in keys if key not in existing]
+    try:
+        with transaction.atomic():
+            ManagerSummary.objects.bulk_create(
+                ManagerSummary(report_count=delta, **{field: key}) for key in missing
+            )
+    except IntegrityError:
+        if not retry:
+            raise
+        # A concurrent transaction inserted some of the rows first.
+        _add_reports(field, delta, missing, retry=False)
+
+
+def update_manager_summaries(added=(), removed=()):
+    """
+    Update the ``ManagerSummary`` table for roles that were ``added`` and
+    ``removed``, inside the current transaction.
+
+    ``added`` and ``removed`` hold the ``(manager_user_id,
+    unregistered_manager_email)`` of each role. Managers with the same change
+    in their number of reports are updated together, in chunks, so a single
+    role costs one ``UPDATE`` in the common case. Does nothing unless
+    ``is_summary_enabled()``.
+    """
+    if not is_summary_enabled():
+        return
+    deltas = {}
+    for sign, roles in ((1, added), (-1, removed)):
+        for manager_id, email in roles:
+            key = _summary_key(manager_id, email)
+            if key[1] is not None:
+                deltas[key] = deltas.get(key, 0) + sign
+    grouped = {}
+    for (field, key), delta in deltas.items():
+        if delta:
+            grouped.setdefault((field, delta), []).append(key)
+    if not grouped:
+        return
+    with transaction.atomic(savepoint=False):
+        for (field, delta), keys in sorted(grouped.items()):
+            for chunk in _chunks(keys):
+                _add_reports(field, delta, chunk)
+
+
+def _refresh_chunk(field, chunk, role_filter):
+    """
+    Recount the reports of the managers whose ``field`` is in ``chunk``.
+
+    Summary rows are locked before counting and updated in place so that
+    they keep their position in the manager list.
+    """
+    summaries = ManagerSummary.objects.filter(**{field + '__in': chunk})
+    existing = dict(summaries.select_for_update().values_list(field, 'report_count'))
+    counts = dict(
+        UserManagerRole.objects.filter(
+            **dict(role_filter, **{field + '__in': chunk})
+        ).order_by().values_list(field).annotate(reports=Count('id'))
+    )
+    summaries.exclude(**{field + '__in': list(counts)}).delete()
+    changed = [(key, reports) for key, reports in counts.items() if key in existing and existing[key] != reports]
+    if changed:
+        summaries.filter(**{field + '__in': [key for key, _ in changed]}).update(
+            report_count=Case(
+                *[When(then=Value(reports), **{field: key}) for key, reports in changed],
+                output_field=IntegerField()
+            ),
+        )
+    ManagerSummary.objects.bulk_create(
+        ManagerSummary(report_count=reports, **{field: key})
+        for key, reports in sorted(counts.items()) if key not in existing
+    )
+
+
+def _refresh_chunk_with_retry(field, chunk, role_filter):
+    """
+    Refresh a chunk, retrying once if a concurrent transaction inserted the
+    summary of a new manager first.
+    """
+    try:
+        with transaction.atomic():
+            _refresh_chunk(field, chunk, role_filter)
+    except IntegrityError:
+        _refresh_chunk(field, chunk, role_filter)
+
+
+def refresh_manager_summaries(manager_ids=(), manager_emails=()):
+    """
+    Recount the reports of ``manager_ids`` and ``manager_emails`` in the
+    ``ManagerSummary`` table, inside the current transaction.
+
+    Managers without reports left are removed from the table. This is used
+    to rebuild the table; role changes are applied with
+    ``update_manager_summaries`` instead.
+    """
+    manager_ids = set(manager_id for manager_id in manager_ids if manager_id is not None)
+    manager_emails = set(email for email in manager_emails if email)
+    if not manager_ids and not manager_emails:
+        return
+    with transaction.atomic():
+        for chunk in _chunks(manager_ids):
+            _refresh_chunk_with_retry('manager_user_id', chunk, {})
+        for chunk in _chunks(manager_emails):
+            _refresh_chunk_with_retry('unregistered_manager_email', chunk, {'manager_user__isnull': True})
+
+
+def _iter_chunks(values, field, chunk_size):
+    """
+    Yield chunks of the flat ``values`` queryset, ordered by ``field``, using
+    keyset pagination on ``field``.
+    """
+    last = None
+    while True:
+        query = values if last is None else values.filter(**{field + '__gt': last})
+        chunk = list(query[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
+
+
+def rebuild_manager_summaries(chunk_size=SUMMARY_CHUNK_SIZE, progress=None):
+    """
+    Rebuild the whole ``ManagerSummary`` table from the role table.
+
+    This works whether or not ``is_summary_enabled()``. Managers are
+    processed in chunks of ``chunk_size``, each in its own transaction.
+    ``progress`` is called with the number of managers processed so far
+    after each chunk. Returns the number of managers processed.
+    """
+    ManagerSummary.objects.all().delete()
+    manager_ids = UserManagerRole.objects.filter(
+        manager_user__isnull=False,
+    ).order_by('manager_user_id').values_list('manager_user_id', flat=True).distinct()
+    manager_emails = UserManagerRole.objects.filter(
+        manager_user__isnull=True,
+    ).order_by('unregistered_manager_email').values_list('unregistered_manager_email', flat=True).distinct()
+    processed = 0
+    for chunk in _iter_chunks(manager_ids, 'manager_user_id', chunk_size):
+        refresh_manager_summaries(manager_ids=chunk)
+        processed += len(chunk)
+        if progress is not None:
+            progress(processed)
+    for chunk in _iter_chunks(manager_emails, 'unregistered_manager_email', chunk_size):
+        refresh_manager_summaries(manager_emails=chunk)
+        processed += len(chunk)
+        if progress is not None:
+            progress(processed)
+    return processed
@@ -0,0 +1,280 @@
+"""
+Synthetic organisation data for load testing User Manager Application.
+
+An organisation is generated level by level: the first level holds the
+top managers, and every user on a lower level reports to one or more
+managers on the level above, so the hierarchy has no cycles. Generation is
+deterministic for a given ``OrgShape``, and can be split over worker
+processes.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import multiprocessing
+import random
+from bisect import bisect_right
+
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+
+from .cache import bump_versions
+from .hierarchy import is_hierarchy_enabled, rebuild_hierarchy
+from .invites import invalidate_pending_invites
+from .models import UserManagerRole
+from .summary import is_summary_enabled, rebuild_manager_summaries
+
+PARETO = 'pareto'
+UNIFORM = 'uniform'
+FANOUT_DISTRIBUTIONS = (PARETO, UNIFORM)
+CHUNK_SIZE = 5000
+
+_worker_state = {}
+
+
+class OrgShape(object):
+    """
+    Parameters of a synthetic organisation.
+
+    Args:
+        num_roles(int): approximate number of ``UserManagerRole`` rows
+        depth(int): number of levels in the hierarchy, at least 2
+        fanout_distribution(str): how reports are spread over the managers of
+            a level, ``pareto`` (skewed) or ``uniform``
+        fanout_skew(float): Pareto shape; lower values give a few managers
+            with very many reports
+        multi_manager_share(float): share of users with a second manager
+        unregistered_share(float): share of links to an unregistered manager email
+        seed(int): seed for the random generator, so runs are reproducible
+        prefix(str): prefix of the generated usernames and emails
+    """
+
+    def __init__(
+            self,
+            num_roles,
+            depth=5,
+            fanout_distribution=PARETO,
+            fanout_skew=1.2,
+            multi_manager_share=0.05,
+            unregistered_share=0.02,
+            seed=0,
+            prefix='synthetic',
+    ):
+        if depth < 2:
+            raise ValueError('An organisation needs at least 2 levels.')
+        if fanout_distribution not in FANOUT_DISTRIBUTIONS:
+            raise ValueError('Unknown fan-out distribution: {}'.format(fanout_distribution))
+        self.num_roles = num_roles
+        self.depth = depth
+        self.fanout_distribution = fanout_distribution
+        self.fanout_skew = fanout_skew
+        self.multi_manager_share = multi_manager_share
+        self.unregistered_share = unregistered_share
+        self.seed = seed
+        self.prefix = prefix
+
+    @property
+    def num_users(self):
+        """
+        Return the number of users, at least one per level.
+        """
+        return max(self.depth, int(self.num_roles / (1 + self.multi_manager_share)) + 1)
+
+    def username(self, index):
+        """
+        Return the username of the user at ``index``.
+        """
+        return '{}-{}'.format(self.prefix, index)
+
+    def email(self, index):
+        """
+        Return the email of the user at ``index``.
+        """
+        return '{}-{}@example.com'.format(self.prefix, index)
+
+    def invite_email(self, level, index):
+        """
+        Return the email of the ``index``-th unregistered manager on ``level``.
+        """
+        return '{}-invite-{}-{}@example.com'.format(self.prefix, level, index)
+
+    def level_starts(self):
+        """
+        Return the index of the first user of each level, growing geometrically.
+        """
+        low, high = 1.0, float(self.num_users)
+        for _ in range(100):
+            ratio = (low + high) / 2
+            if sum(ratio ** level for level in range(self.depth)) > self.num_users:
+                high = ratio
+            else:
+                low = ratio
+        starts = []
+        start = 0
+        for level in range(self.depth):
+            starts.append(start)
+            remaining_levels = self.depth - level - 1
+            start = min(start + max(1, int(round(low ** level))), self.num_users - remaining_levels)
+        return starts
+
+    def manager_weights(self, starts):
+        """
+        Return the cumulative weights of the managers of each level but the last.
+        """
+        rng = random.Random(self.seed)
+        bounds = starts + [self.num_users]
+        weights = []
+        for level in range(self.depth - 1):
+            cumulative = []
+            total = 0.0
+            for _ in range(bounds[level], bounds[level + 1]):
+                if self.fanout_distribution == PARETO:
+                    total += rng.paretovariate(self.fanout_skew)
+                else:
+                    total += 1.0
+                cumulative.append(total)
+            weights.append(cumulative)
+        return weights
+
+
+def iter_roles(shape, user_ids, start, stop, starts=None, weights=None):
+    """
+    Yield unsaved ``UserManagerRole`` objects for the users at indexes
+    ``start`` to ``stop`` of ``user_ids``.
+
+    The result only depends on ``shape`` and ``start``, so ranges can be
+    generated in any order or in parallel.
+    """
+    if starts is None:
+        starts = shape.level_starts()
+    if weights is None:
+        weights = shape.manager_weights(starts)
+    rng = random.Random('{}-{}'.format(shape.seed, start))
+    for index in range(max(start, starts[1]), stop):
+        level = bisect_right(starts, index) - 1
+        cumulative = weights[level - 1]
+        num_invites = max(1, len(cumulative) // 10)
+        managers = set()
+        for _ in range(2 if rng.random() < shape.multi_manager_share else 1):
+            if rng.random() < shape.unregistered_share:
+                managers.add((None, shape.invite_email(level - 1, rng.randrange(num_invites))))
+            else:
+                position = bisect_right(cumulative, rng.random() * cumulative[-1], 0, len(cumulative) - 1)
+                managers.add((user_ids[starts[level - 1] + position], None))
+        for manager_id, manager_email in managers:
+            yield UserManagerRole(
+                user_id=user_ids[index],
+                manager_user_id=manager_id,
+                unregistered_manager_email=manager_email,
+            )
+
+
+def _bulk_insert(model, objects, chunk_size):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= chunk_size:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def _insert_users(task):
+    shape, start, stop = task
+    with transaction.atomic():
+        User.objects.bulk_create([
+            User(username=shape.username(index), email=shape.email(index), password='!')
+            for index in range(start, stop)
+        ])
+    return stop - start
+
+
+def _insert_roles(task):
+    shape, start, stop = task
+    roles = iter_roles(
+        shape,
+        _worker_state['user_ids'],
+        start,
+        stop,
+        _worker_state['starts'],
+        _worker_state['weights'],
+    )
+    with transaction.atomic():
+        _bulk_insert(UserManagerRole, roles, stop - start)
+    return stop - start
+
+
+def _init_worker(state):
+    # Each worker process needs its own database connection.
+    connections.close_all()
+    _worker_state.update(state)
+
+
+def _run(func, tasks, workers, state, progress):
+    _worker_state.update(state)
+    if workers > 1:
+        connections.close_all()
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(state,))
+        try:
+            results = pool.imap_unordered(func, tasks)
+            for count in results:
+                if progress is not None:
+                    progress(count)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            count = func(task)
+            if progress is not None:
+                progress(count)
+
+
+def get_user_ids(shape):
+    """
+    Return the ids of the users of the organisation, ordered by index.
+    """
+    prefix = '{}-'.format(shape.prefix)
+    user_ids = [None] * shape.num_users
+    for username, user_id in User.objects.filter(username__startswith=prefix).values_list('username', 'id'):
+        suffix = username[len(prefix):]
+        if suffix.isdigit() and int(suffix) < shape.num_users:
+            user_ids[int(suffix)] = user_id
+    return user_ids
+
+
+def generate_org(shape, chunk_size=CHUNK_SIZE, workers=1, progress=None):
+    """
+    Insert the users and roles of a synthetic organisation with bulk inserts.
+
+    Each chunk of ``chunk_size`` users or roles is inserted in its own
+    transaction, by one of ``workers`` processes. ``progress`` is called with
+    the phase (``users`` or ``roles``) and the number of users processed by
+    each chunk. Bulk inserts bypass the signals keeping derived data in sync,
+    so afterwards the manager summaries and the hierarchy closure table are
+    rebuilt when enabled, and the pending invite filter and version stamps of
+    the managers list are invalidated.
+
+    Returns the ids of the created users, top managers first.
+    """
+    tasks = [
+        (shape, start, min(start + chunk_size, shape.num_users))
+        for start in range(0, shape.num_users, chunk_size)
+    ]
+
+    def phase_progress(phase):
+        if progress is None:
+            return None
+        return lambda count: progress(phase, count)
+
+    _run(_insert_users, tasks, workers, {}, phase_progress('users'))
+    user_ids = get_user_ids(shape)
+    starts = shape.level_starts()
+    state = {'user_ids': user_ids, 'starts': starts, 'weights': shape.manager_weights(starts)}
+    _run(_insert_roles, tasks, workers, state, phase_progress('roles'))
+    if is_summary_enabled():
+        rebuild_manager_summaries()
+    if is_hierarchy_enabled():
+        rebuild_hierarchy()
+    invalidate_pending_invites()
+    bump_versions()
+    return user_ids
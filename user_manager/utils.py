@@ -3,7 +3,30 @@ Utilities for User Manager Application.
 """
 from __future__ import absolute_import, unicode_literals
 
-from .models import UserManagerRole
+import threading
+from contextlib import contextmanager
+
+import django
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Value, When
+from django.db.models.functions import Coalesce, Lower
+
+from .cache import bump_versions, invalidate_managers, is_cache_enabled, is_versioning_enabled
+from .hierarchy import is_hierarchy_enabled, refresh_hierarchy
+from .invites import invalidate_pending_invites
+from .memo import clear_current_memo
+from .models import UserManagerRole, normalize_email
+from .summary import update_manager_summaries
+
+# Django only supports skipping conflicting rows in ``bulk_create`` from 2.2.
+BULK_CREATE_KWARGS = {'ignore_conflicts': True} if django.VERSION >= (2, 2) else {}
+BULK_CREATE_BATCH_SIZE = 500
+UPGRADE_CHUNK_SIZE = 500
+RECONCILE_BATCH_SIZE = 1000
+LOOKUP_CHUNK_SIZE = 500
+
+_deferred_upgrades = threading.local()
 
 
 def create_user_manager_role(user, manager_user=None, manager_email=None):
@@ -13,7 +36,7 @@ def create_user_manager_role(user, manager_user=None, manager_email=None):
     """
     if manager_email is not None:
         obj, _ = UserManagerRole.objects.get_or_create(
-            unregistered_manager_email=manager_email,
+            unregistered_manager_email=normalize_email(manager_email),
             user=user,
         )
     else:
@@ -22,3 +45,411 @@ def create_user_manager_role(user, manager_user=None, manager_email=None):
             user=user
         )
     return obj
+
+
+def needs_changed_user_ids():
+    """
+    Return whether ``handle_roles_changed`` needs the ids of the users whose
+    managers changed, so callers can skip querying them otherwise.
+    """
+    return is_hierarchy_enabled() or is_cache_enabled() or is_versioning_enabled()
+
+
+def handle_roles_changed(user_ids, added=(), removed=()):
+    """
+    Update everything derived from manager links after the managers of
+    ``user_ids`` changed without sending model signals, e.g. through
+    ``bulk_create``, ``update`` or ``delete_user_manager_roles``.
+
+    ``added`` and ``removed`` hold the ``(manager_user_id,
+    unregistered_manager_email)`` of each role that was added and removed.
+    Nothing is done if both are empty.
+    """
+    added = list(added)
+    removed = list(removed)
+    if not added and not removed:
+        return
+    user_ids = set(user_ids)
+    managers = added + removed
+    update_manager_summaries(added, removed)
+    refresh_hierarchy(user_ids)
+    invalidate_managers(user_ids)
+    bump_versions(
+        user_ids,
+        [manager_id for manager_id, _ in managers],
+        [email for _, email in managers],
+        managers_changed=is_versioning_enabled() and _managers_changed(added, removed),
+    )
+    clear_current_memo()
+
+
+def _managers_changed(added, removed):
+    """
+    Return whether the roles ``added`` and ``removed`` changed the set of
+    managers, by giving a manager their first report or removing their last.
+
+    The reports of the managers involved are counted with one indexed query
+    per chunk of registered managers and of manager emails.
+    """
+    deltas = {}
+    for sign, roles in ((1, added), (-1, removed)):
+        for manager_id, email in roles:
+            key = (manager_id, None) if manager_id is not None else (None, email)
+            deltas[key] = deltas.get(key, 0) + sign
+    deltas = dict((key, delta) for key, delta in deltas.items() if delta)
+    counts = {}
+    for chunk in _chunks([manager_id for manager_id, _ in deltas if manager_id is not None], LOOKUP_CHUNK_SIZE):
+        counts.update(
+            ((manager_id, None), reports)
+            for manager_id, reports in UserManagerRole.objects.filter(
+                manager_user_id__in=chunk,
+            ).order_by().values_list('manager_user_id').annotate(reports=Count('id'))
+        )
+    for chunk in _chunks([email for manager_id, email in deltas if manager_id is None and email], LOOKUP_CHUNK_SIZE):
+        counts.update(
+            ((None, email), reports)
+            for email, reports in UserManagerRole.objects.filter(
+                manager_user__isnull=True,
+                unregistered_manager_email__in=chunk,
+            ).order_by().values_list('unregistered_manager_email').annotate(reports=Count('id'))
+        )
+    return any(
+        (counts.get(key, 0) == 0) != (counts.get(key, 0) - delta == 0)
+        for key, delta in deltas.items()
+    )
+
+
+def _chunks(items, chunk_size):
+    items = sorted(items)
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def get_managers_for_users(usernames=(), emails=(), user_ids=(), chunk_size=LOOKUP_CHUNK_SIZE):
+    """
+    Looks up the managers of many users, given by username, email or id.
+
+    Users are resolved with one ``__in`` query per kind of identifier and
+    their managers with one more query, each split in chunks of
+    ``chunk_size`` values to stay within database parameter limits.
+
+    Returns a dict mapping ``('username', username)``, ``('email', email)``
+    and ``('id', user_id)`` for every user found to a list of
+    ``(manager_user_id, manager_email)`` tuples, where ``manager_user_id`` is
+    ``None`` for managers without an account. Unknown users are left out.
+    """
+    users = {}
+    for field, values in (('username', usernames), ('email', emails), ('id', user_ids)):
+        for chunk in _chunks(set(values), chunk_size):
+            users.update(
+                ((field, value), user_id)
+                for value, user_id in User.objects.filter(**{field + '__in': chunk}).values_list(field, 'id')
+            )
+
+    managers = {user_id: [] for user_id in users.values()}
+    for chunk in _chunks(managers, chunk_size):
+        roles = UserManagerRole.objects.filter(user_id__in=chunk).annotate(
+            manager_email=Coalesce('manager_user__email', 'unregistered_manager_email'),
+        ).order_by('user_id', 'pk').values_list('user_id', 'manager_user_id', 'manager_email')
+        for user_id, manager_user_id, manager_email in roles:
+            managers[user_id].append((manager_user_id, manager_email))
+    return {key: managers[user_id] for key, user_id in users.items()}
+
+
+def _role_key(role):
+    if role.manager_user_id is not None:
+        return role.user_id, role.manager_user_id
+    return role.user_id, role.unregistered_manager_email
+
+
+def bulk_create_roles(roles):
+    """
+    Inserts the unsaved ``UserManagerRole`` objects in ``roles`` with a
+    single bulk insert, skipping duplicates, links that already exist and
+    users that would be their own manager.
+
+    Existing links are found with one query for registered managers and one
+    for unregistered managers.
+
+    Returns the list of roles that were created. Their primary keys are only
+    set on databases that can return them from a bulk insert.
+    """
+    new_roles = {}
+    for role in roles:
+        role.unregistered_manager_email = normalize_email(role.unregistered_manager_email)
+        if role.user_id != role.manager_user_id:
+            new_roles.setdefault(_role_key(role), role)
+    if not new_roles:
+        return []
+
+    registered = [role for role in new_roles.values() if role.manager_user_id is not None]
+    unregistered = [role for role in new_roles.values() if role.manager_user_id is None]
+    with transaction.atomic():
+        existing = set()
+        if registered:
+            existing.update(UserManagerRole.objects.filter(
+                user_id__in=set(role.user_id for role in registered),
+                manager_user_id__in=set(role.manager_user_id for role in registered),
+            ).values_list('user_id', 'manager_user_id'))
+        if unregistered:
+            existing.update(UserManagerRole.objects.filter(
+                user_id__in=set(role.user_id for role in unregistered),
+                unregistered_manager_email__in=set(role.unregistered_manager_email for role in unregistered),
+            ).values_list('user_id', 'unregistered_manager_email'))
+        created = [role for key, role in new_roles.items() if key not in existing]
+        UserManagerRole.objects.bulk_create(
+            created,
+            batch_size=BULK_CREATE_BATCH_SIZE,
+            **BULK_CREATE_KWARGS
+        )
+        # bulk_create doesn't send post_save, so update derived data here.
+        handle_roles_changed(
+            [role.user_id for role in created],
+            added=[(role.manager_user_id, role.unregistered_manager_email) for role in created],
+        )
+        if any(role.manager_user_id is None for role in created):
+            invalidate_pending_invites()
+    return created
+
+
+def bulk_create_user_manager_roles(users, manager_user=None, manager_email=None):
+    """
+    Links all ``users`` to a ``manager_user`` or ``manager_email`` using a
+    single query for existing links and a single bulk insert for the rest.
+
+    Users that would become their own manager are skipped.
+
+    Returns a tuple of the ids of users that were newly linked and the ids of
+    users that were already linked.
+    """
+    if manager_email is not None:
+        manager_email = normalize_email(manager_email)
+        users = [user for user in users if normalize_email(user.email) != manager_email]
+        manager_filter = {'unregistered_manager_email': manager_email}
+    else:
+        users = [user for user in users if user.pk != manager_user.pk]
+        manager_filter = {'manager_user_id': manager_user.pk}
+
+    created = bulk_create_roles(
+        UserManagerRole(user_id=user.pk, **manager_filter) for user in users
+    )
+    new_ids = set(role.user_id for role in created)
+    existing_ids = set(user.pk for user in users) - new_ids
+    return new_ids, existing_ids
+
+
+def delete_user_manager_roles(queryset):
+    """
+    Deletes all roles in the ``UserManagerRole`` ``queryset`` with a single
+    ``DELETE``, instead of fetching and signalling each row.
+
+    Returns the number of deleted roles.
+    """
+    with transaction.atomic():
+        roles = list(queryset.values_list('user_id', 'manager_user_id', 'unregistered_manager_email'))
+        # pylint: disable=protected-access
+        deleted = queryset.order_by()._raw_delete(queryset.db)
+        handle_roles_changed(
+            [user_id for user_id, _, _ in roles],
+            removed=[(manager_id, email) for _, manager_id, email in roles],
+        )
+    return deleted
+
+
+def upgrade_manager_invites(emails):
+    """
+    Links every pending invite for one of ``emails`` to the user account
+    registered with that email.
+
+    Each chunk of emails is upgraded in its own transaction, with one query
+    for the accounts, one locking the pending invites and a single
+    ``UPDATE`` mapping each invite's primary key to its account.
+
+    Returns the number of upgraded roles.
+    """
+    emails = sorted(set(email for email in emails if email))
+    num_upgraded = 0
+    for start in range(0, len(emails), UPGRADE_CHUNK_SIZE):
+        managers = {
+            normalize_email(email): manager_id
+            for email, manager_id in User.objects.filter(
+                email__in=emails[start:start + UPGRADE_CHUNK_SIZE],
+            ).values_list('email', 'id')
+        }
+        if not managers:
+            continue
+        with transaction.atomic():
+            upgraded = list(UserManagerRole.objects.select_for_update().filter(
+                manager_user__isnull=True,
+                unregistered_manager_email__in=list(managers),
+            ).values_list('pk', 'user_id', 'unregistered_manager_email'))
+            if not upgraded:
+                continue
+            # The manager is looked up by primary key rather than by email,
+            # as MySQL applies assignments in order and the email is cleared
+            # in the same UPDATE.
+            num_upgraded += UserManagerRole.objects.filter(
+                pk__in=[pk for pk, _, _ in upgraded],
+            ).update(
+                manager_user=Case(
+                    *[When(pk=pk, then=Value(managers[email])) for pk, _, email in upgraded],
+                    output_field=IntegerField()
+                ),
+                unregistered_manager_email=None,
+            )
+            handle_roles_changed(
+                [user_id for _, user_id, _ in upgraded],
+                added=[(managers[email], None) for _, _, email in upgraded],
+                removed=[(None, email) for _, _, email in upgraded],
+            )
+    return num_upgraded
+
+
+def defer_manager_invite_upgrade(email):
+    """
+    Queues an invite upgrade for ``email`` if upgrades are being deferred.
+
+    Returns whether the upgrade was deferred.
+    """
+    pending = getattr(_deferred_upgrades, 'emails', None)
+    if pending is None:
+        return False
+    pending.add(email)
+    return True
+
+
+@contextmanager
+def defer_manager_invite_upgrades():
+    """
+    Defers the invite upgrades of users registered inside the block, then
+    applies them all in a few set-based queries when it exits.
+
+    Use this around bulk user creation, e.g. bulk enrollment or SSO
+    provisioning. Nested blocks are applied when the outermost one exits.
+    If the block raises, the upgrades are still applied for the users that
+    were kept, unless the whole transaction is about to be rolled back.
+    """
+    if getattr(_deferred_upgrades, 'emails', None) is not None:
+        yield
+        return
+    _deferred_upgrades.emails = set()
+    try:
+        yield
+    finally:
+        emails, _deferred_upgrades.emails = _deferred_upgrades.emails, None
+        # Users rolled back with the block are not found, so only the invites
+        # of users that still exist are upgraded.
+        if not transaction.get_connection().needs_rollback:
+            upgrade_manager_invites(emails)
+
+
+def _find_invited_managers(pending):
+    """
+    Returns a dict mapping the lowercased email of every user with one of the
+    ``pending`` invites to their id, the oldest account winning ties.
+
+    The emails are compared case-insensitively in a single query joining the
+    user table to the invites, so the user table is read once per run rather
+    than once per batch. Only accounts with a pending invite are returned,
+    which are few as the registration signal upgrades most invites.
+    """
+    return dict(
+        User.objects.annotate(
+            email_lower=Lower('email'),
+        ).filter(
+            email_lower__in=pending.order_by().values('unregistered_manager_email'),
+        ).order_by('-id').values_list('email_lower', 'id')
+    )
+
+
+def _reconcile_batch(batch, managers, dry_run):
+    """
+    Upgrades one batch of ``(pk, user_id, unregistered_manager_email)`` rows,
+    given the ``managers`` found by ``_find_invited_managers``.
+
+    Returns a tuple of the number of rows upgraded, duplicates removed and
+    rows left unresolved.
+    """
+    resolved = {}
+    for pk, user_id, email in batch:
+        manager_id = managers.get(normalize_email(email))
+        if manager_id is not None and manager_id != user_id:
+            resolved[pk] = (user_id, manager_id)
+    if not resolved:
+        return 0, 0, len(batch)
+
+    existing = set(UserManagerRole.objects.filter(
+        user_id__in=set(user_id for user_id, _ in resolved.values()),
+        manager_user_id__in=set(manager_id for _, manager_id in resolved.values()),
+    ).values_list('user_id', 'manager_user_id'))
+    duplicates = set()
+    upgrades = {}
+    for pk, pair in resolved.items():
+        if pair in existing:
+            duplicates.add(pk)
+        else:
+            # Several invites may resolve to the same link; upgrade only one.
+            existing.add(pair)
+            upgrades[pk] = pair[1]
+
+    if not dry_run:
+        with transaction.atomic():
+            if duplicates:
+                UserManagerRole.objects.filter(pk__in=duplicates)._raw_delete(  # pylint: disable=protected-access
+                    UserManagerRole.objects.db,
+                )
+            if upgrades:
+                UserManagerRole.objects.filter(pk__in=upgrades.keys()).update(
+                    manager_user=Case(
+                        *[When(pk=pk, then=Value(manager_id)) for pk, manager_id in upgrades.items()],
+                        output_field=IntegerField()
+                    ),
+                    unregistered_manager_email=None,
+                )
+            emails = dict((pk, email) for pk, _, email in batch)
+            handle_roles_changed(
+                [user_id for user_id, _ in resolved.values()],
+                added=[(manager_id, None) for manager_id in upgrades.values()],
+                removed=[(None, emails[pk]) for pk in list(upgrades) + list(duplicates)],
+            )
+    return len(upgrades), len(duplicates), len(batch) - len(resolved)
+
+
+def reconcile_manager_invites(batch_size=RECONCILE_BATCH_SIZE, dry_run=False, progress=None):
+    """
+    Upgrades every pending invite whose email, compared case-insensitively,
+    belongs to a registered user.
+
+    This catches invites missed by the registration signal, e.g. for users
+    created with ``bulk_create``, users that registered before being
+    invited, or emails differing in case. Invites are processed in batches
+    of ``batch_size`` in primary key order, each with a constant number of
+    queries, after matching the emails to accounts once. Invites resolving
+    to a link that already exists are removed.
+
+    ``progress`` is called with the running totals after each batch. With
+    ``dry_run`` nothing is changed and the totals are what would be done.
+
+    Returns a dict with the number of ``processed``, ``upgraded``,
+    ``duplicates`` and ``unresolved`` invites.
+    """
+    totals = {'processed': 0, 'upgraded': 0, 'duplicates': 0, 'unresolved': 0}
+    pending = UserManagerRole.objects.filter(
+        manager_user__isnull=True,
+        unregistered_manager_email__isnull=False,
+    )
+    managers = _find_invited_managers(pending)
+    pending = pending.order_by('pk').values_list('pk', 'user_id', 'unregistered_manager_email')
+    last_pk = 0
+    while True:
+        batch = list(pending.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return totals
+        upgraded, duplicates, unresolved = _reconcile_batch(batch, managers, dry_run)
+        totals['processed'] += len(batch)
+        totals['upgraded'] += upgraded
+        totals['duplicates'] += duplicates
+        totals['unresolved'] += unresolved
+        last_pk = batch[-1][0]
+        if progress is not None:
+            progress(totals)